@@ -0,0 +1,1169 @@
+"""
+Бенчмарки конвертера на локальном поддельном сервере ЦБ РФ.
+
+Запуск: python benchmark.py suite --output results.json --latency 0.05 --error-rate 0.01
+        python benchmark.py compare old.json new.json --threshold 0.1
+        python benchmark.py fetch --dates 30 --latency 0.05
+        python benchmark.py ui --latency 0.2
+        python benchmark.py startup --runs 5
+        python benchmark.py service --clients 50 --requests 5000
+        python benchmark.py parse --repeat 2000
+        python benchmark.py chart --years 10 --redraws 200
+        python benchmark.py providers
+        python benchmark.py polling --polls 20 --error-rate 0.2
+        python benchmark.py analytics --years 12 --currencies 45 --updates 500
+        python benchmark.py backfill --years 3 --latency 0.01
+
+Проверки корректности - providers, history и backfill - обязательны перед слиянием изменений
+в загрузку, кэш и историю курсов. suite запускает их первыми, записывает число проваленных
+в метрику correctness_failures и завершается с кодом 1, если хоть одна не прошла.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import re
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# Бенчмарки работают без дисплея
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import main
+
+# Курсы, которые отдает поддельный сервер: код -> (номинал, базовый курс в рублях)
+FAKE_RATES = {
+    "USD": (1, 90.0),
+    "EUR": (1, 100.0),
+    "GBP": (1, 115.0),
+    "JPY": (100, 60.0),
+    "CNY": (1, 12.5),
+    "BRL": (1, 18.0),
+    "KZT": (100, 19.5),
+    "PLN": (1, 23.0),
+    "BYN": (1, 28.0),
+    "CZK": (10, 39.0),
+    "SEK": (10, 86.0),
+    "RSD": (100, 85.0)
+}
+CBR_IDS_TO_CODES = {cbr_id: code for code, cbr_id in main.CBR_CURRENCY_IDS.items()}
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fake_value(currency, day):
+    """
+    Детерминированный "курс" валюты на дату, чтобы ответы были воспроизводимыми.
+    """
+    nominal, base = FAKE_RATES[currency]
+    return nominal, base * (1 + 0.001 * (day.toordinal() % 30))
+
+
+def publication_day(day):
+    """
+    Дата таблицы, которая действует в день day: как у ЦБ РФ, таблицы датированы вторником - субботой,
+    в воскресенье и понедельник действует субботняя.
+    """
+    while day.weekday() in (0, 6):
+        day -= timedelta(days=1)
+    return day
+
+
+def format_value(value):
+    return f"{value:.4f}".replace('.', ',')
+
+
+def render_daily(day):
+    """
+    XML в формате XML_daily.asp. На выходные отдается таблица последней даты публикации.
+    """
+    day = publication_day(day)
+    parts = [f'<?xml version="1.0" encoding="windows-1251"?><ValCurs Date="{day.strftime("%d.%m.%Y")}" '
+             f'name="Foreign Currency Market">']
+    for currency in FAKE_RATES:
+        nominal, value = fake_value(currency, day)
+        parts.append(f'<Valute ID="{main.CBR_CURRENCY_IDS[currency]}"><NumCode>000</NumCode>'
+                     f'<CharCode>{currency}</CharCode><Nominal>{nominal}</Nominal><Name>{currency}</Name>'
+                     f'<Value>{format_value(value)}</Value></Valute>')
+    parts.append('</ValCurs>')
+    return "".join(parts).encode("windows-1251")
+
+
+def render_dynamic(currency, start, end):
+    """
+    XML в формате XML_dynamic.asp (только даты публикации).
+    """
+    cbr_id = main.CBR_CURRENCY_IDS[currency]
+    parts = [f'<?xml version="1.0" encoding="windows-1251"?><ValCurs ID="{cbr_id}" '
+             f'DateRange1="{start.strftime("%d.%m.%Y")}" DateRange2="{end.strftime("%d.%m.%Y")}" '
+             f'name="Foreign Currency Market Dynamic">']
+    day = start
+    while day <= end:
+        if publication_day(day) == day:
+            nominal, value = fake_value(currency, day)
+            parts.append(f'<Record Date="{day.strftime("%d.%m.%Y")}" Id="{cbr_id}"><Nominal>{nominal}</Nominal>'
+                         f'<Value>{format_value(value)}</Value></Record>')
+        day += timedelta(days=1)
+    parts.append('</ValCurs>')
+    return "".join(parts).encode("windows-1251")
+
+
+class RecordedResponses:
+    """
+    Ответы на основе записанных XML из fixtures/: в дневную таблицу подставляется запрошенная дата,
+    динамика собирается из записанных значений на запрошенный период.
+    """
+
+    def __init__(self):
+        self.daily = load_fixture("XML_daily.xml")
+        self.daily_date = re.search(rb'Date="([\d.]+)"', self.daily)[1]
+        self.records = re.findall(rb"<Nominal>(\d+)</Nominal><Value>([\d,]+)</Value>", load_fixture("XML_dynamic.xml"))
+
+    def render_daily(self, day):
+        day = publication_day(day)
+        return self.daily.replace(b'Date="' + self.daily_date + b'"',
+                                  b'Date="' + day.strftime("%d.%m.%Y").encode("ascii") + b'"', 1)
+
+    def render_dynamic(self, currency, start, end):
+        cbr_id = main.CBR_CURRENCY_IDS[currency]
+        parts = [f'<?xml version="1.0" encoding="windows-1251"?><ValCurs ID="{cbr_id}" '
+                 f'DateRange1="{start.strftime("%d.%m.%Y")}" DateRange2="{end.strftime("%d.%m.%Y")}" '
+                 f'name="Foreign Currency Market Dynamic">']
+        day = start
+        while day <= end:
+            if publication_day(day) == day:
+                nominal, value = self.records[day.toordinal() % len(self.records)]
+                parts.append(f'<Record Date="{day.strftime("%d.%m.%Y")}" Id="{cbr_id}">'
+                             f'<Nominal>{nominal.decode()}</Nominal><Value>{value.decode()}</Value>'
+                             f'<VunitRate>{value.decode()}</VunitRate></Record>')
+            day += timedelta(days=1)
+        parts.append('</ValCurs>')
+        return "".join(parts).encode("windows-1251")
+
+
+class FakeCbrHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего сервера
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.server.requests_count += 1
+        time.sleep(self.server.latency)
+
+        # Внедрение ошибок: часть ответов (или все после fail_after запросов) заканчивается кодом 503
+        fail_after = self.server.fail_after
+        if (self.server.error_rate and random.random() < self.server.error_rate) or \
+                (fail_after is not None and self.server.requests_count > fail_after):
+            self.server.errors_injected += 1
+            self.send_error(503)
+            return
+
+        responses = self.server.recorded or sys.modules[__name__]
+        try:
+            if url.path.endswith("XML_daily.asp"):
+                day = datetime.strptime(query["date_req"], "%d/%m/%Y").date() if "date_req" in query \
+                    else date.today()
+                body = responses.render_daily(day)
+            elif url.path.endswith("XML_dynamic.asp"):
+                body = responses.render_dynamic(CBR_IDS_TO_CODES[query["VAL_NM_RQ"]],
+                                                datetime.strptime(query["date_req1"], "%d/%m/%Y").date(),
+                                                datetime.strptime(query["date_req2"], "%d/%m/%Y").date())
+            else:
+                self.send_error(404)
+                return
+        except (KeyError, ValueError):
+            self.send_error(400)
+            return
+
+        # Условные запросы: неизменившийся ответ не передается повторно
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml; charset=windows-1251")
+        self.send_header("ETag", etag)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.server.requests_count += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml; charset=windows-1251")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class FakeCbrServer:
+    """
+    Локальный поддельный сервер ЦБ РФ с искусственной задержкой ответа и внедрением ошибок.
+    recorded=True - отдавать ответы на основе записанных XML из fixtures/, иначе синтетические.
+    redirect=False - не перенаправлять на сервер адреса ЦБ РФ (например, для зеркала).
+    fail_after - после стольких запросов сервер отвечает только ошибками (обрыв посреди работы).
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, recorded=False, redirect=True, fail_after=None):
+        self.redirect = redirect
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeCbrHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.fail_after = fail_after
+        self.httpd.recorded = RecordedResponses() if recorded else None
+        self.httpd.requests_count = 0
+        self.httpd.errors_injected = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}/scripts/"
+
+    @property
+    def requests_count(self):
+        return self.httpd.requests_count
+
+    @property
+    def errors_injected(self):
+        return self.httpd.errors_injected
+
+    def __enter__(self):
+        self.thread.start()
+        # Направляем все запросы приложения на поддельный сервер
+        if self.redirect:
+            main.CBR_DAILY_URL = self.base_url + "XML_daily.asp"
+            main.CBR_DYNAMIC_URL = self.base_url + "XML_dynamic.asp"
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+# Временный каталог для снимков курсов, чтобы бенчмарки не трогали файлы пользователя
+SCRATCH_DIR = tempfile.TemporaryDirectory(prefix="cbr-bench-")
+
+
+def fresh_state(providers=None):
+    """
+    Новые HTTP-клиент, база в памяти, пустые снимок и календарь и кэш, чтобы замеры не влияли друг на друга.
+    providers - источники таблиц вместо одного ЦБ РФ.
+    """
+    main.http_fetcher = main.HttpFetcher()
+    main.rate_providers = main.ProviderPool(providers or [main.CbrProvider()])
+    main.rate_store = main.RateStore(":memory:")
+    main.rate_snapshot = main.RateSnapshot(tempfile.mktemp(suffix=".snapshot", dir=SCRATCH_DIR.name))
+    main.publication_calendar = main.PublicationCalendar(main.rate_store)
+    main.currency_catalogue = main.CurrencyCatalogue(main.rate_store)
+    main.rate_cache = main.RateCache(store=main.rate_store, snapshot=main.rate_snapshot,
+                                     calendar=main.publication_calendar, fetcher=main.rate_providers.fetch)
+
+
+def bench_fetch(dates_count, latency, workers):
+    """
+    Сравнивает последовательную и параллельную загрузку таблиц на несколько дат.
+    """
+    days = [date(2024, 1, 1) + timedelta(days=i) for i in range(dates_count)]
+    with FakeCbrServer(latency=latency) as server:
+        fresh_state()
+        sequential = timed(lambda: [main.fetch_cbr_rates(day) for day in days])
+
+        fresh_state()
+        concurrent = timed(main.fetch_rates_many, days, max_workers=workers)
+        requests_count = server.requests_count
+
+    print(f"Дат: {dates_count}, задержка сервера: {latency * 1000:.0f} мс, потоков: {workers}")
+    print(f"Последовательно: {sequential:.3f} с")
+    print(f"Параллельно:     {concurrent:.3f} с (ускорение x{sequential / concurrent:.1f})")
+    print(f"Запросов к серверу: {requests_count}")
+
+
+def bench_ui(latency, budget_ms=16.0):
+    """
+    Измеряет задержки цикла событий Qt при конвертации и загрузке графика.
+    Таймер с интервалом 1 мс фиксирует самый большой разрыв между срабатываниями.
+    Возвращает False, если разрыв превысил budget_ms или действие завершилось ошибкой.
+    """
+    from PyQt6.QtCore import QElapsedTimer, QTimer
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])
+    errors = []
+
+    with FakeCbrServer(latency=latency):
+        fresh_state()
+        main.check_internet_connection = lambda: True  # Внешние сайты в бенчмарке не проверяем
+
+        window = main.CurrencyConverterApp()
+        window.show_error = errors.append
+        window.save_settings = lambda: None  # Не перезаписываем настройки пользователя
+        window.from_amount_input.setText("100")
+        window.show()
+        # Пользователь нажимает кнопку не раньше, чем окно отрисовано и выполнены отложенные задачи запуска
+        settle = time.perf_counter() + (main.CHART_WARM_UP_DELAY_MS + 500) / 1000
+        while time.perf_counter() < settle:
+            app.processEvents()
+            time.sleep(0.001)
+
+        clock = QElapsedTimer()
+        stalls = []
+        last_tick = [0]
+
+        def tick():
+            now = clock.elapsed()
+            stalls.append(now - last_tick[0])
+            last_tick[0] = now
+
+        def wait_until_idle(timeout=30.0):
+            deadline = time.perf_counter() + timeout
+            while window.active_workers and time.perf_counter() < deadline:
+                app.processEvents()
+                time.sleep(0.001)
+
+        timer = QTimer()
+        timer.setInterval(1)
+        timer.timeout.connect(tick)
+
+        results = {}
+        for name, action in (("convert_currency", window.convert_currency), ("show_chart", window.show_chart)):
+            wait_until_idle()
+            stalls.clear()
+            clock.start()
+            last_tick[0] = 0
+            timer.start()
+            action()
+            wait_until_idle()
+            app.processEvents()
+            timer.stop()
+            results[name] = max(stalls, default=0)
+
+        window.close()
+
+    print(f"Задержка сервера: {latency * 1000:.0f} мс, бюджет: {budget_ms:.0f} мс")
+    for name, stall in results.items():
+        verdict = "OK" if stall <= budget_ms else "ПРЕВЫШЕН"
+        print(f"{name}: максимальная задержка цикла событий {stall} мс ({verdict})")
+    for error in errors:
+        print(f"Ошибка: {error}")
+    return not errors and all(stall <= budget_ms for stall in results.values())
+
+
+# Скрипт холодного запуска: время импорта main и время до первой отрисовки окна
+STARTUP_SCRIPT = r"""
+import json, os, resource, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from PyQt6.QtCore import QEvent, QObject
+from PyQt6.QtWidgets import QApplication
+
+
+class FirstPaintFilter(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            print(json.dumps({"import": imported - start, "first_paint": time.perf_counter() - start,
+                              "matplotlib_loaded": "matplotlib" in sys.modules,
+                              "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+            sys.stdout.flush()
+            os._exit(0)
+        return False
+
+
+app = QApplication([])
+window = main.CurrencyConverterApp()
+paint_filter = FirstPaintFilter()
+window.installEventFilter(paint_filter)
+window.show()
+app.exec()
+"""
+
+
+def measure_startup(runs):
+    """
+    Запускает приложение в отдельных процессах и измеряет время импорта и первой отрисовки окна.
+    """
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=60).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "import": statistics.median(sample["import"] for sample in samples),
+        "first_paint": statistics.median(sample["first_paint"] for sample in samples),
+        "max_rss_mb": statistics.median(sample["max_rss_kb"] for sample in samples) / 1024,
+        "matplotlib_loaded": any(sample["matplotlib_loaded"] for sample in samples)
+    }
+
+
+def bench_startup(runs):
+    startup = measure_startup(runs)
+    print(f"Запусков: {runs}")
+    print(f"Импорт main: {startup['import'] * 1000:.0f} мс (медиана)")
+    print(f"Первая отрисовка окна: {startup['first_paint'] * 1000:.0f} мс (медиана)")
+    print(f"Пиковая память процесса: {startup['max_rss_mb']:.1f} МБ (медиана)")
+    print(f"matplotlib загружен при старте: {'да' if startup['matplotlib_loaded'] else 'нет'}")
+
+
+async def load_test_client(port, paths, latencies):
+    """
+    Один клиент нагрузочного теста: последовательные запросы по keep-alive соединению.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            status_line = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            if b" 200 " not in status_line:
+                raise RuntimeError(f"Неожиданный ответ сервиса: {status_line!r}")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_polling(polls, error_rate):
+    """
+    Опрос сегодняшней таблицы, как при истекающем TTL: первый ответ целиком (сжатый gzip),
+    дальше ответы 304 без тела. С error_rate часть ответов - 503, их скрывают повторы в пределах бюджета.
+    """
+    with FakeCbrServer(error_rate=error_rate) as server:
+        fresh_state()
+        main.rate_cache.today_ttl = 0  # Каждый опрос идет на сервер
+        fetcher = main.http_fetcher
+        failures = 0
+        main.rate_cache.get(None)
+        first = dict(fetcher.stats())
+        for _ in range(polls):
+            try:
+                main.rate_cache.get(None)
+            except Exception:
+                failures += 1
+        stats = fetcher.stats()
+
+    print(f"Первый запрос: {first['bytes_received']} байт по сети, {first['bytes_decoded']} после распаковки")
+    polled = stats["bytes_received"] - first["bytes_received"]
+    print(f"Опросов: {polls}, ответов 304: {stats['not_modified']}, "
+          f"по сети {polled} байт ({polled / polls:.0f} байт на опрос)")
+    print(f"Запросов к серверу: {server.requests_count}, внедрено ошибок: {server.errors_injected}, "
+          f"повторов: {stats['retries']}, отказано бюджетом: {stats['retries_denied']}, неудачных опросов: {failures}")
+
+
+def check_providers(dates_count=10):
+    """
+    Проверки пула источников на локальных заменах: медленный ЦБ РФ с быстрым зеркалом (хеджирование),
+    ЦБ РФ с ошибками (переключение и понижение в рейтинге), недоступный ЦБ РФ с каталогом файлов
+    и отказ всех источников. Возвращает True, если все проверки прошли.
+    """
+    days = [date(2024, 3, 5) + timedelta(days=i) for i in range(dates_count)]
+    checks = []
+
+    def check(name, ok, details):
+        checks.append(ok)
+        print(f"{'OK' if ok else 'ОШИБКА'}: {name} ({details})")
+
+    def fetch_all():
+        start = time.perf_counter()
+        tables, errors = [], []
+        for day in days:
+            try:
+                tables.append(main.rate_providers.fetch(day))
+            except Exception as e:
+                errors.append(e)
+        return tables, errors, (time.perf_counter() - start) / len(days)
+
+    with FakeCbrServer(latency=1.0), FakeCbrServer(latency=0.02, redirect=False) as mirror:
+        fresh_state([main.CbrProvider(), main.CbrProvider(mirror.base_url + "XML_daily.asp", name="mirror")])
+        tables, errors, elapsed = fetch_all()
+        check("хеджирование медленного ЦБ РФ", not errors and elapsed < 0.9,
+              f"{elapsed * 1000:.0f} мс на дату, хеджей {main.rate_providers.hedged}, "
+              f"первым выбран {main.rate_providers.ranked()[0].name}")
+
+    with FakeCbrServer(error_rate=1.0) as primary, FakeCbrServer(redirect=False) as mirror:
+        fresh_state([main.CbrProvider(), main.CbrProvider(mirror.base_url + "XML_daily.asp", name="mirror")])
+        tables, errors, _ = fetch_all()
+        check("переключение при ошибках ЦБ РФ", not errors and primary.requests_count < len(days),
+              f"запросов к ЦБ РФ {primary.requests_count}, к зеркалу {mirror.requests_count}, "
+              f"переключений {main.rate_providers.failovers}")
+
+    with tempfile.TemporaryDirectory() as drop_dir:
+        for day in days:
+            with open(os.path.join(drop_dir, f"XML_daily_{day.isoformat()}.xml"), "wb") as f:
+                f.write(render_daily(day))
+        with FakeCbrServer() as primary:
+            pass  # Сервер остановлен: ЦБ РФ недоступен, адрес указывает на закрытый порт
+        fresh_state([main.CbrProvider(), main.FileDropProvider(drop_dir)])
+        tables, errors, _ = fetch_all()
+        expected = fake_value("USD", publication_day(days[0]))
+        check("каталог файлов при недоступном ЦБ РФ",
+              not errors and abs(tables[0]["USD"] - expected[0] / expected[1]) < 1e-9,
+              f"получено таблиц {len(tables)}")
+
+        fresh_state([main.CbrProvider(), main.FileDropProvider(os.path.join(drop_dir, "missing"))])
+        tables, errors, _ = fetch_all()
+        check("ошибка, если отказали все источники",
+              not tables and all(isinstance(e, main.requests.RequestException) for e in errors),
+              f"ошибок {len(errors)}")
+
+    def fetch_in_background():
+        # Как поток упреждающей загрузки: весь трафик его запросов должен списываться с бюджета
+        result = {}
+
+        def run():
+            main.HttpFetcher.mark_background()
+            for day in days:
+                main.rate_providers.fetch(day)
+            result["charged"] = main.HttpFetcher.thread_bytes_received()
+            result["background"] = main.HttpFetcher.thread_context()[0]
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return result.get("charged", 0), result.get("background", False)
+
+    with FakeCbrServer():
+        fresh_state()
+        charged, background = fetch_in_background()
+        check("трафик фонового потока учтен (один источник)",
+              background and charged == main.http_fetcher.bytes_received > 0,
+              f"списано {charged} из {main.http_fetcher.bytes_received} байт")
+
+    with FakeCbrServer(), FakeCbrServer(redirect=False) as mirror:
+        fresh_state([main.CbrProvider(), main.CbrProvider(mirror.base_url + "XML_daily.asp", name="mirror")])
+        charged, background = fetch_in_background()
+        check("трафик фонового потока учтен (пул источников)",
+              background and charged == main.http_fetcher.bytes_received > 0,
+              f"списано {charged} из {main.http_fetcher.bytes_received} байт")
+    return all(checks)
+
+
+def check_history(from_currency="USD", to_currency="EUR"):
+    """
+    Проверки get_cbr_history на поддельном сервере: история через XML_dynamic.asp (один запрос на валюту,
+    повторный вызов - из локальной базы), запасной путь по дням при недоступной динамике
+    и ошибка для неизвестной валюты. Курсы сверяются с курсами сервера. Возвращает True, если проверки прошли.
+    """
+    start, end = date(2024, 1, 1), date(2024, 3, 31)
+    checks = []
+
+    def check(name, ok, details):
+        checks.append(ok)
+        print(f"{'OK' if ok else 'ОШИБКА'}: {name} ({details})")
+
+    def expected(days):
+        def per_rub(code, day):
+            nominal, value = fake_value(code, publication_day(day))
+            return nominal / value
+        return np.array([per_rub(to_currency, day) / per_rub(from_currency, day) for day in days])
+
+    published = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    published = [day for day in published if publication_day(day) == day]
+    with FakeCbrServer() as server:
+        fresh_state()
+        dates, rates = main.get_cbr_history(from_currency, to_currency, start, end)
+        same_days = np.array_equal(dates, np.array(published, dtype="datetime64[D]"))
+        check("история через XML_dynamic", same_days and np.allclose(rates, expected(published), rtol=1e-4),
+              f"точек {len(dates)} из {len(published)}, запросов {server.requests_count}")
+
+        requests_before = server.requests_count
+        warm_dates, warm_rates = main.get_cbr_history(from_currency, to_currency, start, end)
+        check("повторный вызов из локальной базы",
+              server.requests_count == requests_before and np.array_equal(warm_rates, rates),
+              f"запросов {server.requests_count - requests_before}")
+
+        fresh_state()
+        main.CBR_DYNAMIC_URL = server.base_url + "missing.asp"  # Динамика отвечает 404
+        dates, rates = main.get_cbr_history(from_currency, to_currency, start, end)
+        days = [end - timedelta(days=i) for i in range(main.HISTORY_FALLBACK_DAYS)][::-1]
+        same_days = np.array_equal(dates, np.array(days, dtype="datetime64[D]"))
+        check("запасной путь по дням", same_days and np.allclose(rates, expected(days), rtol=1e-4),
+              f"точек {len(dates)}, без курса {int(np.isnan(rates).sum())}")
+
+        try:
+            main.get_cbr_history(from_currency, "XYZ", start, end)
+            error = None
+        except ValueError as e:
+            error = e
+        check("ошибка для неизвестной валюты", error is not None, str(error))
+    return all(checks)
+
+
+def check_backfill(years, latency, workers, parse_workers, sequential_sample=30):
+    """
+    Команда backfill на поддельном сервере с синтетической историей за years лет.
+    Первый запуск обрывается на середине (сервер начинает отвечать 503), повторный продолжает
+    с контрольных точек. Файл сверяется с курсами сервера, время - с последовательной загрузкой
+    по одной дате (оценка по первым sequential_sample дням). Возвращает True, если проверки прошли.
+    """
+    end = date(2024, 6, 30)
+    start = end - timedelta(days=int(years * 365.25) - 1)
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    published = [day for day in days if publication_day(day) == day]
+    output = os.path.join(SCRATCH_DIR.name, "backfill.snapshot")
+    checks = []
+
+    def check(name, ok, details):
+        checks.append(ok)
+        print(f"{'OK' if ok else 'ОШИБКА'}: {name} ({details})")
+
+    with FakeCbrServer(latency=latency, fail_after=len(published) * 3 // 4):
+        fresh_state()
+        interrupted = main.Backfill(output, start, end, workers, parse_workers).run()
+    check("прерванная загрузка не создает файл", interrupted["failed"] > 0 and not os.path.exists(output),
+          f"не загружено частей {interrupted['failed']} из {interrupted['shards']}")
+
+    with FakeCbrServer(latency=latency) as server:
+        fresh_state()
+        begin = time.perf_counter()
+        resumed = main.Backfill(output, start, end, workers, parse_workers).run()
+        elapsed = time.perf_counter() - begin
+        check("повторный запуск продолжает с контрольных точек",
+              resumed["rows"] and 0 < resumed["resumed"] == interrupted["shards"] - interrupted["failed"],
+              f"готовых частей {resumed['resumed']}, запросов {server.requests_count}")
+
+        fresh_state()
+        sequential = timed(lambda: [main.fetch_cbr_rates(day) for day in days[:sequential_sample]])
+
+    snapshot = main.RateSnapshot(output).load()
+    codes = [code for code in snapshot.codes if code != "RUB"]
+    expected = np.array([[fake_value(code, day)[0] / fake_value(code, day)[1] for code in codes] for day in published])
+    values = snapshot.values[:, [snapshot.codes.index(code) for code in codes]]
+    same_days = np.array_equal(snapshot.days, np.array(published, dtype="datetime64[D]").astype(np.int64))
+    check("файл совпадает с историей сервера", same_days and np.allclose(values, expected, rtol=1e-4),
+          f"таблиц {len(snapshot.days)} из {len(published)}, валют {len(snapshot.codes)}, "
+          f"{os.path.getsize(output) / 1024:.0f} КБ")
+
+    estimate = sequential / sequential_sample * len(days)
+    print(f"Загрузка {years} лет ({len(days)} дней): {elapsed:.1f} с, потоков {workers}, процессов разбора "
+          f"{parse_workers if parse_workers is not None else os.cpu_count()}; по одной дате подряд - около "
+          f"{estimate:.0f} с (x{estimate / elapsed:.0f})")
+    return all(checks)
+
+
+def bench_service(clients, requests_count, dates_count, latency):
+    """
+    Нагрузочный тест HTTP-сервиса конвертации: запросы в секунду, p50 и p99 задержки,
+    и сколько раз сервис на самом деле обратился к поддельному серверу ЦБ РФ.
+    """
+    days = [date(2024, 1, 1) + timedelta(days=i) for i in range(dates_count)]
+    codes = list(FAKE_RATES)
+    paths = [f"/convert?amount=100&from={codes[i % len(codes)]}&to=RUB&date={days[i % len(days)].isoformat()}"
+             for i in range(requests_count)]
+
+    with FakeCbrServer(latency=latency) as upstream:
+        fresh_state()
+        service = main.ConversionService()
+
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(service.start("127.0.0.1", 0))
+        port = server.sockets[0].getsockname()[1]
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        async def run_clients():
+            latencies = []
+            await asyncio.gather(*(load_test_client(port, paths[i::clients], latencies) for i in range(clients)))
+            return latencies
+
+        start = time.perf_counter()
+        latencies = asyncio.run(run_clients())
+        elapsed = time.perf_counter() - start
+        upstream_requests = upstream.requests_count
+
+        async def shutdown():
+            server.close()
+            await server.wait_closed()
+            await asyncio.sleep(0.1)  # Даем обработчикам соединений завершиться
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    print(f"Клиентов: {clients}, запросов: {requests_count}, дат: {dates_count}, "
+          f"задержка ЦБ РФ: {latency * 1000:.0f} мс")
+    print(f"Запросов в секунду: {len(latencies) / elapsed:.0f}")
+    print(f"p50: {percentile(latencies, 0.50) * 1000:.2f} мс, p99: {percentile(latencies, 0.99) * 1000:.2f} мс")
+    print(f"Загрузок таблиц: {service.upstream_loads}, объединено запросов: {service.coalesced}, "
+          f"запросов к ЦБ РФ: {upstream_requests}")
+
+
+def legacy_parse_cbr_rates(content):
+    """
+    Прежний разбор XML_daily.asp: декодирование в текст, дерево ElementTree и словарь. Для сравнения.
+    """
+    root = ET.fromstring(content.decode("windows-1251"))
+    rates = {"RUB": 1.0}
+    for valute in root.findall("Valute"):
+        char_code = valute.find("CharCode").text
+        value = valute.find("Value").text
+        nominal = int(valute.find("Nominal").text)
+        rates[char_code] = nominal / float(value.replace(',', '.'))
+    return rates
+
+
+def legacy_parse_cbr_dynamic(content):
+    """
+    Прежний разбор XML_dynamic.asp через дерево ElementTree. Для сравнения.
+    """
+    root = ET.fromstring(content.decode("windows-1251"))
+    series = {}
+    for record in root.findall("Record"):
+        day = datetime.strptime(record.get("Date"), "%d.%m.%Y").date()
+        series[day] = int(record.find("Nominal").text) / float(record.find("Value").text.replace(',', '.'))
+    return series
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def bench_parse(repeat):
+    """
+    Микробенчмарк разбора XML ЦБ РФ по записанным ответам из fixtures/:
+    документов в секунду и пиковый объем памяти, выделяемой на один разбор.
+    """
+    cases = [
+        ("XML_daily.xml", "старый", legacy_parse_cbr_rates),
+        ("XML_daily.xml", "быстрый", main.parse_cbr_rates),
+        ("XML_dynamic.xml", "старый", legacy_parse_cbr_dynamic),
+        ("XML_dynamic.xml", "быстрый", main.parse_cbr_dynamic),
+    ]
+    for fixture, label, parse in cases:
+        content = load_fixture(fixture)
+        parse(content)  # Прогрев
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse(content)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        parse(content)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{fixture} ({len(content)} байт), {label} разбор: {repeat / elapsed:.0f} документов/с, "
+              f"пик памяти {peak / 1024:.1f} КБ")
+
+
+def measure_chart(years, redraws):
+    """
+    Время открытия встроенного графика (загрузка ряда и первая отрисовка) и перерисовки
+    при прокрутке и масштабировании по синтетическому ряду за years лет.
+    """
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])
+    end = date.today()
+    dates = np.arange(np.datetime64(end) - int(years * 365.25), np.datetime64(end) + 1, dtype="datetime64[D]")
+    rng = np.random.default_rng(1)
+    rates = 90 + np.cumsum(rng.normal(0, 0.5, len(dates)))
+    rates[rng.random(len(dates)) < 0.01] = np.nan  # Пропуски в данных, как в выходные без курса
+
+    chart = main.RateChart()
+    chart.resize(800, 400)
+    chart.show()
+    app.processEvents()
+
+    start = time.perf_counter()
+    chart.set_series(dates, rates, "USD -> RUB")
+    chart.repaint()
+    opened = time.perf_counter() - start
+
+    timings = []
+    actions = [lambda: chart.zoom(1.25), lambda: chart.pan(-30), lambda: chart.zoom(0.8), lambda: chart.pan(30)]
+    chart.set_view(chart.days[0], chart.days[-1])  # Перерисовки идут по всему ряду - худший случай
+    for i in range(redraws):
+        start = time.perf_counter()
+        actions[i % len(actions)]()
+        chart.repaint()
+        timings.append(time.perf_counter() - start)
+    chart.close()
+    return {"points": len(dates), "open": opened, "redraw_mean": statistics.mean(timings),
+            "redraw_max": max(timings)}
+
+
+def bench_chart(years, redraws):
+    result = measure_chart(years, redraws)
+    print(f"Точек в ряду: {result['points']} ({years} лет)")
+    print(f"Открытие графика: {result['open'] * 1000:.1f} мс")
+    print(f"Перерисовка: в среднем {result['redraw_mean'] * 1000:.2f} мс, "
+          f"максимум {result['redraw_max'] * 1000:.2f} мс")
+
+
+def measure_analytics(years, currencies, updates,
+                      windows=(main.ANALYTICS_WINDOW, main.ANALYTICS_INCREMENTAL_MIN_WINDOW, 250)):
+    """
+    Скользящие показатели по всем парам: загрузка истории из базы, и для каждого окна - полный расчет,
+    стоимость добавления одной даты (против пересчета с нуля), расхождение с пересчетом
+    и ряды одной пары за всю историю.
+    Синтетическая история - years лет дат публикации (пн-пт) по currencies валютам.
+    """
+    codes = [f"C{i:02d}" for i in range(currencies - 1)] + ["RUB"]
+    end = np.datetime64(date.today())
+    days = np.arange(end - int(years * 365.25) - updates, end + 1, dtype="datetime64[D]")
+    days = days[np.is_busday(days)]
+    rng = np.random.default_rng(1)
+    values = np.exp(np.cumsum(rng.normal(0, 0.006, (len(days), len(codes))), axis=0)) / rng.uniform(1, 100, len(codes))
+    values[:, -1] = 1.0
+    values[: len(days) // 3, 0] = np.nan  # Валюта, которой в начале истории еще не было
+    history, arriving = slice(0, len(days) - updates), slice(len(days) - updates, len(days))
+
+    store = main.RateStore(":memory:")
+    for column, code in enumerate(codes[:-1]):
+        series = {day.astype(object): value for day, value in zip(days[history], values[history, column])
+                  if np.isfinite(value)}
+        store.save_series(code, days[0].astype(object), days[history][-1].astype(object), series)
+    loaded = timed(store.history_matrix, codes, days[0].astype(object), days[history][-1].astype(object))
+    result = {"dates": len(days), "pairs": len(codes) ** 2, "load": loaded, "windows": {}}
+
+    for window in windows:
+        start = time.perf_counter()
+        analytics = main.RollingAnalytics.from_store(codes, days[0].astype(object),
+                                                     days[history][-1].astype(object), store, window)
+        built = time.perf_counter() - start
+
+        timings = []
+        error = 0.0
+        for i, (day, row) in enumerate(zip(days[arriving], values[arriving])):
+            start = time.perf_counter()
+            analytics.append(day.astype(object), row)
+            timings.append(time.perf_counter() - start)
+            if i >= updates - 5:  # Последние обновления сверяются с пересчетом с нуля
+                reference = main.RollingAnalytics(days[:arriving.start + i + 1],
+                                                  values[:arriving.start + i + 1], codes, window)
+                error = max(error, *(float(np.nanmax(np.abs(getattr(analytics, name)() - getattr(reference, name)())))
+                                     for name in ("mean", "volatility", "change")))
+        recompute = timed(lambda: [analytics.recompute() for _ in range(20)]) / 20
+        pair_series = timed(lambda: [analytics.pair_series(codes[0], codes[1]) for _ in range(20)]) / 20
+        result["windows"][window] = {"build": built, "update_mean": statistics.mean(timings),
+                                     "update_max": max(timings), "recompute": recompute,
+                                     "pair_series": pair_series, "max_error": error}
+    return result
+
+
+def bench_analytics(years, currencies, updates):
+    result = measure_analytics(years, currencies, updates)
+    print(f"Дат: {result['dates']} ({years} лет), пар валют: {result['pairs']}")
+    print(f"Загрузка истории из базы: {result['load'] * 1000:.1f} мс")
+    for window, stats in result["windows"].items():
+        print(f"Окно {window} дат: расчет {stats['build'] * 1000:.1f} мс, добавление даты в среднем "
+              f"{stats['update_mean'] * 1e6:.0f} мкс (максимум {stats['update_max'] * 1e6:.0f} мкс, "
+              f"пересчет с нуля {stats['recompute'] * 1e6:.0f} мкс), ряды одной пары "
+              f"{stats['pair_series'] * 1000:.2f} мс, расхождение {stats['max_error']:.1e}"
+              f"{'  ДОБАВЛЕНИЕ МЕДЛЕННЕЕ ПЕРЕСЧЕТА' if stats['update_mean'] > stats['recompute'] * 1.1 else ''}")
+
+
+def metric(name, value, unit, better):
+    return {"name": name, "value": value, "unit": unit, "better": better}
+
+
+def mean_time(func, args_list):
+    """
+    Среднее время вызова по списку аргументов и число вызовов, завершившихся ошибкой.
+    """
+    times = []
+    failures = 0
+    for args in args_list:
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except Exception:
+            failures += 1
+        times.append(time.perf_counter() - start)
+    return statistics.mean(times), failures
+
+
+def check_api_available():
+    """
+    check_api_status, который считает ошибкой любой статус, кроме "API доступен".
+    """
+    status_text, status_color = main.check_api_status()
+    if status_color != "green":
+        raise ConnectionError(status_text)
+
+
+def run_suite(latency, error_rate, startup_runs, batch_rows):
+    """
+    Полный набор замеров на записанных ответах ЦБ РФ. Возвращает список метрик.
+    """
+    results = []
+    days = [date(2024, 1, 9) + timedelta(days=i) for i in range(20)]
+
+    with FakeCbrServer(latency=latency, error_rate=error_rate, recorded=True) as server:
+        fresh_state()
+        cold, cold_failures = mean_time(main.get_cbr_exchange_rate, [("USD", "EUR", day) for day in days])
+        warm, _ = mean_time(main.get_cbr_exchange_rate, [("USD", "EUR", day) for day in days])
+        results += [metric("get_rate_cold", cold * 1000, "ms", "lower"),
+                    metric("get_rate_warm", warm * 1e6, "us", "lower"),
+                    metric("get_rate_failures", cold_failures, "count", "lower")]
+
+        fresh_state()
+        chart_args = [("USD", "EUR", date(2023, 1, 1), date(2023, 12, 31))]
+        chart_cold, chart_cold_failures = mean_time(main.get_cbr_history, chart_args)
+        chart_warm, chart_warm_failures = mean_time(main.get_cbr_history, chart_args * 5)
+        results += [metric("chart_history_1y_cold", chart_cold * 1000, "ms", "lower"),
+                    metric("chart_history_1y_warm", chart_warm * 1000, "ms", "lower"),
+                    metric("chart_history_failures", chart_cold_failures + chart_warm_failures, "count", "lower")]
+
+        api_status, api_status_failures = mean_time(check_api_available, [()] * 10)
+        results += [metric("check_api_status", api_status * 1000, "ms", "lower"),
+                    metric("check_api_status_failures", api_status_failures, "count", "lower")]
+
+        fresh_state()
+        codes = list(FAKE_RATES) + ["RUB"]
+        rng = random.Random(1)
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path, output_path = os.path.join(tmp, "in.csv"), os.path.join(tmp, "out.csv")
+            with open(input_path, "w", encoding="utf-8", newline="") as f:
+                f.write("amount,from_currency,to_currency,date\n")
+                for _ in range(batch_rows):
+                    f.write(f"{rng.uniform(1, 1000):.2f},{rng.choice(codes)},{rng.choice(codes)},"
+                            f"{rng.choice(days).isoformat()}\n")
+            batch = timed(main.convert_file, input_path, output_path)
+        results.append(metric("batch_throughput", batch_rows / batch, "rows/s", "higher"))
+        results.append(metric("upstream_requests", server.requests_count, "count", "lower"))
+        results.append(metric("errors_injected", server.errors_injected, "count", "lower"))
+
+    for fixture, parse in (("XML_daily.xml", main.parse_cbr_rates), ("XML_dynamic.xml", main.parse_cbr_dynamic)):
+        content = load_fixture(fixture)
+        elapsed = timed(lambda: [parse(content) for _ in range(500)])
+        results.append(metric(f"parse_{fixture.split('.')[0].lower()}", 500 / elapsed, "docs/s", "higher"))
+
+    chart = measure_chart(10, 100)
+    results += [metric("chart_open_10y", chart["open"] * 1000, "ms", "lower"),
+                metric("chart_redraw_10y", chart["redraw_mean"] * 1000, "ms", "lower")]
+
+    analytics = measure_analytics(10, 45, 200)["windows"][main.ANALYTICS_WINDOW]
+    results += [metric("analytics_update", analytics["update_mean"] * 1e6, "us", "lower"),
+                metric("analytics_recompute", analytics["recompute"] * 1e6, "us", "lower"),
+                metric("analytics_pair_series_10y", analytics["pair_series"] * 1000, "ms", "lower")]
+
+    if startup_runs:
+        startup = measure_startup(startup_runs)
+        results += [metric("startup_import", startup["import"] * 1000, "ms", "lower"),
+                    metric("startup_first_paint", startup["first_paint"] * 1000, "ms", "lower"),
+                    metric("startup_rss", startup["max_rss_mb"], "MB", "lower")]
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_checks():
+    """
+    Проверки корректности (providers, history и короткий backfill), без которых замеры не имеют смысла.
+    Возвращает названия проваленных проверок.
+    """
+    checks = (("providers", check_providers),
+              ("history", check_history),
+              ("backfill", lambda: check_backfill(1, 0.0, main.FETCH_WORKERS, None)))
+    failed = []
+    for name, check in checks:
+        print(f"Проверки {name}:")
+        try:
+            ok = check()
+        except Exception as e:
+            print(f"ОШИБКА: {e!r}")
+            ok = False
+        if not ok:
+            failed.append(name)
+    return failed
+
+
+def bench_suite(output, latency, error_rate, startup_runs, batch_rows):
+    """
+    Запускает проверки корректности и набор замеров и сохраняет результаты в JSON
+    (или печатает, если файл не указан). Возвращает False, если какая-то проверка не прошла.
+    """
+    failed = run_checks()
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {"latency": latency, "error_rate": error_rate, "startup_runs": startup_runs,
+                   "batch_rows": batch_rows},
+        "failed_checks": failed,
+        "metrics": [metric("correctness_failures", len(failed), "checks", "lower")]
+                   + run_suite(latency, error_rate, startup_runs, batch_rows)
+    }
+    text = json.dumps(report, indent=4, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+        for item in report["metrics"]:
+            print(f"{item['name']}: {item['value']:.2f} {item['unit']}")
+    else:
+        print(text)
+    for name in failed:
+        print(f"ОШИБКА: не прошли проверки {name}")
+    return not failed
+
+
+def compare_reports(old_path, new_path, threshold):
+    """
+    Сравнивает два JSON-отчета. Возвращает код выхода 1, если какая-то метрика ухудшилась больше чем на threshold.
+    """
+    with open(old_path, encoding="utf-8") as f:
+        old = {item["name"]: item for item in json.load(f)["metrics"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = {item["name"]: item for item in json.load(f)["metrics"]}
+
+    regressions = 0
+    for name, item in new.items():
+        if name not in old:
+            print(f"{name}: {item['value']:.2f} {item['unit']} (новая метрика)")
+            continue
+        before, after = old[name]["value"], item["value"]
+        if before:
+            change = (after - before) / before
+            worse = change > threshold if item["better"] == "lower" else change < -threshold
+            change_text = f"{change * 100:+.1f}%"
+        else:
+            # От нуля относительное изменение не определено: любой рост "lower"-метрики - регрессия
+            worse = after > 0 if item["better"] == "lower" else after < 0
+            change_text = "было 0"
+        regressions += worse
+        print(f"{name}: {before:.2f} -> {after:.2f} {item['unit']} ({change_text})"
+              f"{'  РЕГРЕССИЯ' if worse else ''}")
+    return 1 if regressions else 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарки конвертера валют")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    suite_parser = subparsers.add_parser("suite", help="проверки корректности и полный набор замеров с выводом в JSON")
+    suite_parser.add_argument("--output", help="файл для JSON-отчета")
+    suite_parser.add_argument("--latency", type=float, default=0.02, help="задержка сервера, секунды")
+    suite_parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой 503")
+    suite_parser.add_argument("--startup-runs", type=int, default=3)
+    suite_parser.add_argument("--batch-rows", type=int, default=100_000)
+
+    compare_parser = subparsers.add_parser("compare", help="сравнение двух JSON-отчетов")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="допустимое ухудшение, доля")
+
+    fetch_parser = subparsers.add_parser("fetch", help="последовательная и параллельная загрузка дат")
+    fetch_parser.add_argument("--dates", type=int, default=30)
+    fetch_parser.add_argument("--latency", type=float, default=0.05, help="задержка сервера, секунды")
+    fetch_parser.add_argument("--workers", type=int, default=main.FETCH_WORKERS)
+
+    ui_parser = subparsers.add_parser("ui", help="задержки цикла событий Qt при работе с сетью")
+    ui_parser.add_argument("--latency", type=float, default=0.2, help="задержка сервера, секунды")
+    ui_parser.add_argument("--budget", type=float, default=16.0, help="допустимая задержка, мс")
+
+    startup_parser = subparsers.add_parser("startup", help="время импорта и первой отрисовки окна")
+    startup_parser.add_argument("--runs", type=int, default=5)
+
+    service_parser = subparsers.add_parser("service", help="нагрузочный тест HTTP-сервиса конвертации")
+    service_parser.add_argument("--clients", type=int, default=50)
+    service_parser.add_argument("--requests", type=int, default=5000)
+    service_parser.add_argument("--dates", type=int, default=5)
+    service_parser.add_argument("--latency", type=float, default=0.1, help="задержка сервера, секунды")
+
+    parse_parser = subparsers.add_parser("parse", help="скорость разбора XML ЦБ РФ по fixtures/")
+    parse_parser.add_argument("--repeat", type=int, default=2000)
+
+    chart_parser = subparsers.add_parser("chart", help="открытие и перерисовка встроенного графика")
+    chart_parser.add_argument("--years", type=int, default=10)
+    chart_parser.add_argument("--redraws", type=int, default=200)
+
+    subparsers.add_parser("providers", help="проверки хеджирования и переключения источников")
+    subparsers.add_parser("history", help="проверки истории курса через динамику и по дням")
+
+    polling_parser = subparsers.add_parser("polling", help="трафик и повторы при опросе сегодняшней таблицы")
+    polling_parser.add_argument("--polls", type=int, default=20)
+    polling_parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой 503")
+
+    analytics_parser = subparsers.add_parser("analytics", help="скользящие показатели по всем парам валют")
+    analytics_parser.add_argument("--years", type=int, default=12)
+    analytics_parser.add_argument("--currencies", type=int, default=45)
+    analytics_parser.add_argument("--updates", type=int, default=500, help="сколько дат добавить по одной")
+
+    backfill_parser = subparsers.add_parser("backfill", help="загрузка многолетней истории с продолжением")
+    backfill_parser.add_argument("--years", type=int, default=3)
+    backfill_parser.add_argument("--latency", type=float, default=0.01)
+    backfill_parser.add_argument("--workers", type=int, default=main.FETCH_WORKERS)
+    backfill_parser.add_argument("--parse-workers", type=int, default=None)
+
+    args = parser.parse_args()
+    if args.command == "suite":
+        sys.exit(0 if bench_suite(args.output, args.latency, args.error_rate, args.startup_runs, args.batch_rows) else 1)
+    elif args.command == "compare":
+        sys.exit(compare_reports(args.old, args.new, args.threshold))
+    elif args.command == "fetch":
+        bench_fetch(args.dates, args.latency, args.workers)
+    elif args.command == "ui":
+        sys.exit(0 if bench_ui(args.latency, args.budget) else 1)
+    elif args.command == "startup":
+        bench_startup(args.runs)
+    elif args.command == "service":
+        bench_service(args.clients, args.requests, args.dates, args.latency)
+    elif args.command == "parse":
+        bench_parse(args.repeat)
+    elif args.command == "chart":
+        bench_chart(args.years, args.redraws)
+    elif args.command == "providers":
+        sys.exit(0 if check_providers() else 1)
+    elif args.command == "history":
+        sys.exit(0 if check_history() else 1)
+    elif args.command == "polling":
+        bench_polling(args.polls, args.error_rate)
+    elif args.command == "analytics":
+        bench_analytics(args.years, args.currencies, args.updates)
+    elif args.command == "backfill":
+        sys.exit(0 if check_backfill(args.years, args.latency, args.workers, args.parse_workers) else 1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,181 +1,3251 @@
 import sys
+import argparse
+import asyncio
+import csv
+import itertools
+import math
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
-from datetime import datetime, timedelta
+from xml.parsers import expat
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import date as date_cls, datetime, timedelta
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
 from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QLabel, QPushButton, QComboBox, QDateEdit, \
-    QMessageBox, QLineEdit, QHBoxLayout
-from PyQt6.QtGui import QPixmap, QIcon, QFont
-from PyQt6.QtCore import Qt, QTimer, QPropertyAnimation
+    QMessageBox, QLineEdit, QHBoxLayout, QProgressBar
+from PyQt6.QtGui import QIcon, QFont, QPainter, QPen, QColor, QPolygonF, QKeySequence
+from PyQt6.QtCore import Qt, QTimer, QPropertyAnimation, QObject, QRunnable, QThreadPool, pyqtSignal, QPointF, QRectF, \
+    QAbstractListModel, QModelIndex
 import socket  # Для проверки интернет-соединения
-import matplotlib.pyplot as plt  # Для отображения графика
 import os
 import ssl
 import time
 import logging
 import json
-import os
+import contextlib
+import re
+import sqlite3
+import threading
+import queue
+import random
+import shutil
+import multiprocessing
+import numpy as np
 
 # Настроим логирование
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(message)s")
 
-SAVE_FILE = "last_conversion.json"
+SAVE_FILE = "last_conversion.json"
+
+
+def save_conversion(conversion_data):
+    """Сохраняет данные конвертации в файл."""
+    with open(SAVE_FILE, "w", encoding="utf-8") as f:
+        json.dump(conversion_data, f, indent=4, ensure_ascii=False)
+
+
+def load_conversion():
+    """Загружает данные последней конверсии из файла."""
+    if os.path.exists(SAVE_FILE):
+        with open(SAVE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+
+def check_internet_connection():
+    """
+    Проверяет подключение к интернету через несколько популярных веб-сайтов.
+    Использует несколько этапов подключения для повышения надежности.
+    """
+    # Список сайтов для проверки
+    test_sites = [
+        ("www.google.com", 80),  # HTTP
+        ("www.google.com", 443),  # HTTPS
+        ("www.yandex.ru", 80),
+        ("www.microsoft.com", 443)
+    ]
+
+    for site, port in test_sites:
+        try:
+            start_time = time.time()  # Засекаем время подключения
+            # Пробуем создать сокет-соединение
+            logging.info(f"Попытка подключения к {site} через порт {port}...")
+
+            # Если порт HTTPS, создаем защищенное соединение
+            if port == 443:
+                context = ssl.create_default_context()
+                with context.wrap_socket(socket.socket(socket.AF_INET), server_hostname=site) as sock:
+                    sock.settimeout(5)
+                    sock.connect((site, port))
+            else:
+                with socket.create_connection((site, port), timeout=5) as sock:
+                    pass  # Если подключение успешно, выходим из блока
+
+            # Вычисление времени подключения
+            elapsed_time = time.time() - start_time
+            logging.info(f"Подключение к {site} успешно выполнено за {elapsed_time:.2f} секунд.")
+            return True  # Если одно соединение успешно, возвращаем True
+
+        except (socket.timeout, socket.error, ssl.SSLError) as e:
+            logging.error(f"Ошибка при подключении к {site} через порт {port}: {e}")
+            continue  # Пробуем следующий сайт
+
+    # Если не удалось подключиться ни к одному из сайтов
+    logging.error("Не удалось установить подключение к интернету.")
+    return False
+
+
+HTTP_TIMEOUT = (5, 15)  # Таймауты подключения и чтения, секунды
+HTTP_RETRIES = 3  # Сколько раз повторять запрос после сетевой ошибки или ответа 429/5xx
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+HTTP_RETRY_BASE_DELAY = 0.2  # Пауза перед первым повтором, дальше удваивается (со случайным разбросом)
+HTTP_RETRY_MAX_DELAY = 5.0
+RETRY_BUDGET_RATIO = 0.1  # Повторов не больше 10% от числа запросов...
+RETRY_BUDGET_MAX = 10  # ...с запасом на короткую серию сбоев
+REVALIDATE_CACHE_SIZE = 32  # Сколько ответов хранить для условных запросов (ETag/Last-Modified)
+HEALTH_TTL = 120  # Через сколько секунд статус API считается устаревшим
+HEALTH_PROBE_INTERVAL = 60  # Интервал фоновой проверки API, секунды
+HEALTH_RETRY_INTERVAL = 5  # Первая повторная проверка после ошибки, дальше интервал удваивается
+HEALTH_MAX_BACKOFF = 300  # Максимальный интервал между проверками при ошибках
+FETCH_WORKERS = 8  # Сколько запросов к ЦБ РФ выполнять одновременно
+HISTORY_FALLBACK_DAYS = 62  # Сколько последних дней запрашивать по одному, если динамика недоступна
+CHART_HISTORY_DAYS = 10 * 365 + 3  # История для графика загружается один раз за 10 лет
+CHART_VISIBLE_DAYS = 30  # Сколько дней видно на графике сразу после загрузки
+CHART_MIN_SPAN_DAYS = 7  # Максимальное приближение графика
+CHART_WARM_UP_DELAY_MS = 500  # Пробная отрисовка графика после запуска, когда окно уже показано
+ANALYTICS_WINDOW = 20  # Окно скользящих показателей в датах публикации (около месяца торговых дней)
+ANALYTICS_INCREMENTAL_MIN_WINDOW = 32  # На окнах короче пересчет с нуля быстрее обновлений ранга 1
+LIVE_CONVERT_DELAY_MS = 300  # Пауза во вводе, после которой загружается отсутствующая таблица курсов
+AMOUNT_STEP = 10  # Шаг кнопок +/-
+
+CBR_DAILY_URL = "https://www.cbr.ru/scripts/XML_daily.asp"
+CBR_DYNAMIC_URL = "https://www.cbr.ru/scripts/XML_dynamic.asp"
+
+# Дополнительные источники дневных таблиц в формате XML_daily.asp
+MIRROR_URLS_ENV = "CBR_MIRROR_URLS"  # Адреса зеркал через запятую
+DROP_DIR_ENV = "CBR_DROP_DIR"  # Каталог с файлами XML_daily_ГГГГ-ММ-ДД.xml
+HEDGE_DELAY = 0.3  # Через сколько секунд без ответа запрос дублируется к следующему источнику
+PROVIDER_HEALTH_ALPHA = 0.2  # Вес последнего запроса в скользящих оценках источника
+
+# Внутренние коды валют ЦБ РФ, нужные для запроса динамики курса
+CBR_CURRENCY_IDS = {
+    "USD": "R01235",
+    "EUR": "R01239",
+    "GBP": "R01035",
+    "JPY": "R01820",
+    "CNY": "R01375",
+    "BRL": "R01115",
+    "KZT": "R01335",
+    "PLN": "R01565",
+    "BYN": "R01090B",
+    "CZK": "R01760",
+    "SEK": "R01770",
+    "RSD": "R01805F"
+}
+
+# Валюты, доступные в интерфейсе, и их флаги
+CURRENCY_FLAGS = [
+    ("USD", "flags/united-states.png"),
+    ("EUR", "flags/european-union.png"),
+    ("GBP", "flags/united-kingdom.png"),
+    ("JPY", "flags/japan.png"),
+    ("CNY", "flags/china.png"),
+    ("RUB", "flags/russia.png"),
+    ("BRL", "flags/brazil.png"),
+    ("KZT", "flags/kazakhstan.png"),
+    ("PLN", "flags/poland.png"),
+    ("BYN", "flags/belarus.png"),
+    ("CZK", "flags/czech-republic.png"),
+    ("SEK", "flags/sweden.png"),
+    ("RSD", "flags/serbia.png")
+]
+CURRENCY_CODES = [currency for currency, _ in CURRENCY_FLAGS]
+# Флаги для валют, которые появляются в каталоге из ленты ЦБ РФ
+CURRENCY_FLAG_FILES = dict(CURRENCY_FLAGS, TRY="flags/turkey.png")
+RATE_STORE_FILE = "rates.sqlite3"  # Локальная база истории курсов
+BATCH_CHUNK_SIZE = 100_000  # Сколько строк пакетной конвертации держать в памяти одновременно
+BATCH_FIELDS = ["amount", "from_currency", "to_currency", "date"]
+SERVICE_HOST = "127.0.0.1"  # Адрес HTTP-сервиса конвертации
+SERVICE_PORT = 8080
+PROFILE_ENV = "CBR_PROFILE"  # CBR_PROFILE=1 включает сбор метрик
+METRICS_FILE = "metrics.json"  # Куда сохранять метрики при завершении приложения
+RATE_CACHE_SIZE = 64  # Сколько таблиц держать в памяти
+TODAY_RATES_TTL = 15 * 60  # Через сколько секунд перезапрашивать сегодняшнюю таблицу
+RATE_SNAPSHOT_FILE = "rates.snapshot"  # Двоичный снимок всех таблиц курсов для работы без сети
+PREFETCH_WORKERS = 2  # Сколько фоновых упреждающих загрузок выполнять одновременно
+PREFETCH_BYTES_PER_SECOND = 256 * 1024  # Бюджет трафика упреждающих загрузок
+PREFETCH_NEIGHBOUR_DAYS = 3  # Сколько соседних с выбранной дат загружать заранее
+PREFETCH_NEXT_DAY_INTERVAL = 15 * 60  # Как часто проверять, опубликована ли таблица на завтра
+CBR_PUBLISH_HOUR = 12  # Раньше этого часа таблицу на следующий день не ищем
+CALENDAR_CURRENCY = "USD"  # Валюта с курсом на каждую дату публикации, по ее динамике строится календарь
+CALENDAR_PROBE_MIN_DAYS = 7  # С какого числа неизвестных дат диапазон сначала уточняется одним запросом динамики
+BACKFILL_START = date_cls(1992, 7, 1)  # С этой даты ЦБ РФ публикует ежедневные курсы
+BACKFILL_SHARD_DAYS = 31  # Календарных дней в одной части загрузки истории (и в одной контрольной точке)
+
+
+def as_date(value=None):
+    """
+    Приводит datetime/date/None к date. None означает сегодняшний день.
+    """
+    if value is None:
+        return date_cls.today()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def day_start(day):
+    """
+    Отметка времени (time.time()) начала дня по местному времени.
+    """
+    return time.mktime(day.timetuple())
+
+
+class _StageTimer:
+    """
+    Замер длительности одного этапа; ошибка внутри блока считается отказом этапа.
+    """
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.inc("failures_total", stage=self.stage)
+        return False
+
+
+class Metrics:
+    """
+    Счетчики и гистограммы задержек по этапам: fetch, parse, cache_lookup, convert, render.
+    По умолчанию выключены: inc/observe сразу возвращаются, а timer() отдает общий пустой контекст.
+    Экспорт - текст в формате Prometheus или JSON.
+    """
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    _NULL_TIMER = contextlib.nullcontext()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._counters = {}  # (имя, метки) -> значение
+        self._histograms = {}  # этап -> [счетчики по корзинам..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = [0] * len(self.BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def timer(self, stage):
+        """
+        Контекстный менеджер для замера этапа: with metrics.timer("parse"): ...
+        """
+        return _StageTimer(self, stage) if self.enabled else self._NULL_TIMER
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                "stages": {stage: {"count": histogram[-1], "sum_seconds": histogram[-2],
+                                   "buckets": dict(zip(map(str, self.BUCKETS), histogram[:len(self.BUCKETS)]))}
+                           for stage, histogram in sorted(self._histograms.items())}
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"cbr_{name}{{{label_text}}} {value}" if label_text else f"cbr_{name} {value}")
+            if self._histograms:
+                lines.append("# TYPE cbr_stage_duration_seconds histogram")
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, count in zip(self.BUCKETS, histogram):
+                    lines.append(f'cbr_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'cbr_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'cbr_stage_duration_seconds_sum{{stage="{stage}"}} {histogram[-2]}')
+                lines.append(f'cbr_stage_duration_seconds_count{{stage="{stage}"}} {histogram[-1]}')
+        return "\n".join(lines) + "\n"
+
+    def save(self, path=METRICS_FILE):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, indent=4, ensure_ascii=False)
+
+
+metrics = Metrics(enabled=bool(os.environ.get(PROFILE_ENV)))
+
+
+class HttpFetcher:
+    """
+    Общий HTTP-клиент: один Session с пулом keep-alive соединений, таймаутами и сжатием gzip.
+    Одинаковые запросы, выполняющиеся одновременно, отправляются на сервер только один раз.
+    Сетевые ошибки и ответы 429/5xx повторяются с растущей паузой со случайным разбросом,
+    пока не исчерпан общий бюджет повторов. Запросы с revalidate=True отправляются условными
+    (If-None-Match/If-Modified-Since), и ответ 304 заменяется сохраненным ответом.
+    """
+
+    def __init__(self, pool_size=FETCH_WORKERS, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._in_flight = {}  # (url, параметры) -> Future с ответом
+        self._lock = threading.Lock()
+        self._foreground_done = threading.Condition(self._lock)
+        self._foreground = 0  # Сколько запросов пользователя выполняется сейчас
+        self._validators = OrderedDict()  # (url, параметры) -> (ETag, Last-Modified, ответ)
+        self._retry_tokens = float(RETRY_BUDGET_MAX)
+        self.requests_sent = 0
+        self.requests_shared = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self.not_modified = 0
+        self.bytes_received = 0  # Байт по сети (сжатых)
+        self.bytes_decoded = 0  # Байт после распаковки
+
+    # Отметка потоков упреждающей загрузки; их запросы уступают запросам пользователя
+    _thread_state = threading.local()
+
+    @classmethod
+    def mark_background(cls):
+        """
+        Помечает текущий поток как фоновый: его новые запросы ждут, пока выполняются запросы пользователя.
+        """
+        cls._thread_state.background = True
+        cls._thread_state.traffic = [0]  # Байт, полученных запросами потока; общий счетчик с его хеджами
+
+    @classmethod
+    def thread_bytes_received(cls):
+        traffic = getattr(cls._thread_state, "traffic", None)
+        return traffic[0] if traffic else 0
+
+    @classmethod
+    def thread_context(cls):
+        """
+        Отметка текущего потока (фоновый ли он и его счетчик трафика) для передачи в поток пула.
+        """
+        return getattr(cls._thread_state, "background", False), getattr(cls._thread_state, "traffic", None)
+
+    @classmethod
+    @contextlib.contextmanager
+    def bind_thread(cls, context):
+        """
+        Выполняет запросы текущего потока от имени другого: с его отметкой и счетчиком трафика.
+        Прежняя отметка потока восстанавливается на выходе.
+        """
+        saved = cls.thread_context()
+        cls._thread_state.background, cls._thread_state.traffic = context
+        try:
+            yield
+        finally:
+            cls._thread_state.background, cls._thread_state.traffic = saved
+
+    def get(self, url, params=None, revalidate=False):
+        """
+        Выполняет GET-запрос. Если такой же запрос уже выполняется, ждет его ответа.
+        revalidate=True - повторный запрос того же адреса делается условным.
+        """
+        key = (url, tuple(sorted((params or {}).items())))
+        background = getattr(self._thread_state, "background", False)
+        with self._lock:
+            while background and self._foreground:
+                self._foreground_done.wait()
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.requests_sent += 1
+                if not background:
+                    self._foreground += 1
+            else:
+                self.requests_shared += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            response = self._send(key, url, params, revalidate, background)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if not background:
+                    self._foreground -= 1
+                    if not self._foreground:
+                        self._foreground_done.notify_all()
+
+
+    def _send(self, key, url, params, revalidate, background):
+        headers = {}
+        cached = self._validators.get(key) if revalidate else None
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        with self._lock:
+            self._retry_tokens = min(self._retry_tokens + RETRY_BUDGET_RATIO, RETRY_BUDGET_MAX)
+        attempt = 0
+        while True:
+            error = None
+            try:
+                # Отказы считаются по попыткам: исключение учитывает таймер, ответ с ошибкой - строка ниже
+                with metrics.timer("fetch"):
+                    response = self.session.get(url, params=params, timeout=self.timeout, headers=headers)
+                if not response.ok:
+                    metrics.inc("failures_total", stage="fetch")
+                self._count_bytes(response, background)
+                if response.status_code not in HTTP_RETRY_STATUSES:
+                    break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt >= HTTP_RETRIES or not self._take_retry_token():
+                if error is not None:
+                    raise error
+                break  # Ответ с ошибкой вернется вызывающему, raise_for_status решит, что с ним делать
+            attempt += 1
+            self.retries += 1
+            metrics.inc("http_retries_total")
+            # Экспоненциальная пауза с полным случайным разбросом, чтобы клиенты не повторяли запросы хором
+            time.sleep(random.uniform(0, min(HTTP_RETRY_BASE_DELAY * 2 ** (attempt - 1), HTTP_RETRY_MAX_DELAY)))
+
+        if response.status_code == 304 and cached:
+            self.not_modified += 1
+            metrics.inc("http_not_modified_total")
+            return cached[2]
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if revalidate and response.ok and (etag or last_modified):
+            with self._lock:
+                self._validators[key] = (etag, last_modified, response)
+                self._validators.move_to_end(key)
+                while len(self._validators) > REVALIDATE_CACHE_SIZE:
+                    self._validators.popitem(last=False)
+        return response
+
+    def _take_retry_token(self):
+        with self._lock:
+            if self._retry_tokens >= 1:
+                self._retry_tokens -= 1
+                return True
+            self.retries_denied += 1
+        metrics.inc("http_retries_denied_total")
+        return False
+
+    def _count_bytes(self, response, background):
+        decoded = len(response.content)
+        try:
+            wire = response.raw.tell()  # Прочитано из сокета до распаковки
+        except (AttributeError, OSError):
+            wire = decoded
+        self.bytes_received += wire
+        self.bytes_decoded += decoded
+        metrics.inc("bytes_downloaded_total", wire)
+        traffic = getattr(self._thread_state, "traffic", None)
+        if background and traffic is not None:
+            with self._lock:
+                traffic[0] += wire
+
+    def head(self, url):
+        """
+        Легкий HEAD-запрос для проверки доступности сервера. Если сервер не поддерживает HEAD (405/501),
+        статус берется из GET, тело ответа при этом не скачивается.
+        """
+        response = self.session.head(url, timeout=self.timeout)
+        if response.status_code in (HTTPStatus.METHOD_NOT_ALLOWED, HTTPStatus.NOT_IMPLEMENTED):
+            response = self.session.get(url, timeout=self.timeout, stream=True)
+            response.close()
+        return response
+
+    def stats(self):
+        """
+        Счетчики запросов, повторов и трафика.
+        """
+        return {"requests_sent": self.requests_sent, "requests_shared": self.requests_shared,
+                "retries": self.retries, "retries_denied": self.retries_denied,
+                "not_modified": self.not_modified, "bytes_received": self.bytes_received,
+                "bytes_decoded": self.bytes_decoded}
+
+
+http_fetcher = HttpFetcher()
+
+
+def cbr_get(url, params=None, revalidate=False):
+    """
+    Запрос к ЦБ РФ через общий HTTP-клиент. Исход запроса сообщается монитору api_health.
+    """
+    try:
+        response = http_fetcher.get(url, params, revalidate)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        api_health.report_failure(e)
+        raise
+    api_health.report_success()
+    return response
+
+
+# Общая для процесса нумерация валют: код -> позиция в массивах RateTable.
+# Позиции только добавляются, поэтому таблицы, разобранные раньше, остаются корректными.
+CURRENCY_INDEX = {"RUB": 0}
+for _currency in CURRENCY_CODES:
+    CURRENCY_INDEX.setdefault(_currency, len(CURRENCY_INDEX))
+_currency_index_lock = threading.Lock()
+
+
+def currency_slot(currency):
+    """
+    Позиция валюты в CURRENCY_INDEX; новая валюта получает следующую свободную позицию.
+    """
+    slot = CURRENCY_INDEX.get(currency)
+    if slot is None:
+        with _currency_index_lock:
+            slot = CURRENCY_INDEX.setdefault(currency, len(CURRENCY_INDEX))
+    return slot
+
+
+class RateTable:
+    """
+    Компактная таблица курсов на одну дату: массив float64, где values[CURRENCY_INDEX[код]] -
+    единиц валюты за 1 рубль (NaN, если валюты в таблице нет). Ведет себя как словарь только для чтения.
+    """
+    __slots__ = ("date", "values")
+
+    def __init__(self, values, date=None):
+        self.values = values
+        self.date = date  # Дата публикации из ответа ЦБ РФ, если известна
+
+    @classmethod
+    def from_dict(cls, rates, date=None):
+        slots = [currency_slot(currency) for currency in rates]
+        values = np.full(len(CURRENCY_INDEX), np.nan)
+        values[slots] = list(rates.values())
+        return cls(values, date)
+
+    def _slot(self, currency):
+        slot = CURRENCY_INDEX.get(currency)
+        if slot is None or slot >= len(self.values) or np.isnan(self.values[slot]):
+            return None
+        return slot
+
+    def __contains__(self, currency):
+        return self._slot(currency) is not None
+
+    def __getitem__(self, currency):
+        slot = self._slot(currency)
+        if slot is None:
+            raise KeyError(currency)
+        return float(self.values[slot])
+
+    def get(self, currency, default=None):
+        slot = self._slot(currency)
+        return default if slot is None else float(self.values[slot])
+
+    def keys(self):
+        size = len(self.values)
+        return [currency for currency, slot in CURRENCY_INDEX.items()
+                if slot < size and not np.isnan(self.values[slot])]
+
+    def items(self):
+        return [(currency, float(self.values[CURRENCY_INDEX[currency]])) for currency in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int(np.count_nonzero(~np.isnan(self.values)))
+
+    def as_dict(self):
+        return dict(self.items())
+
+
+def parse_cbr_xml(content, record_tag, on_record):
+    """
+    Потоковый разбор XML ЦБ РФ парсером expat, без построения дерева элементов.
+    Для каждой записи record_tag вызывает on_record(атрибуты записи, {тег поля: текст}).
+    Возвращает атрибуты корневого элемента. Ошибки формата приводятся к ET.ParseError.
+    """
+    root_attrs = {}
+    record_attrs = None
+    fields = {}
+    text = []
+    depth = 0
+
+    def start_element(name, attrs):
+        nonlocal record_attrs, depth
+        if depth == 0:
+            root_attrs.update(attrs)
+        elif name == record_tag:
+            record_attrs = attrs
+            fields.clear()
+        depth += 1
+        text.clear()
+
+    def end_element(name):
+        nonlocal record_attrs, depth
+        depth -= 1
+        if name == record_tag:
+            on_record(record_attrs, fields)
+            record_attrs = None
+        elif record_attrs is not None:
+            fields[name] = "".join(text)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = text.append
+    try:
+        parser.Parse(content, True)
+    except (expat.ExpatError, KeyError, ValueError) as e:
+        raise ET.ParseError(f"Некорректный XML ЦБ РФ: {e}") from e
+    return root_attrs
+
+
+# Быстрый разбор байтов ответа ЦБ РФ без построения дерева и без декодирования текста.
+# Если документ устроен не так, как ожидается, используется строгий разбор через parse_cbr_xml.
+_CBR_DATE_RE = re.compile(rb'<ValCurs[^>]*?\sDate="(\d\d)\.(\d\d)\.(\d{4})"')
+_CBR_VALUTE_RE = re.compile(
+    rb"<CharCode>\s*([A-Z]{3})\s*</CharCode>\s*<Nominal>\s*(\d+)\s*</Nominal>.*?"
+    rb"<Value>\s*(\d+)(?:,(\d+))?\s*</Value>", re.S)
+_CBR_RECORD_RE = re.compile(
+    rb'<Record\s+Date="(\d\d)\.(\d\d)\.(\d{4})"[^>]*>\s*<Nominal>\s*(\d+)\s*</Nominal>\s*'
+    rb"<Value>\s*(\d+)(?:,(\d+))?\s*</Value>")
+
+
+def _scan_value(nominal, whole, fraction):
+    return int(nominal) / float(whole + b"." + (fraction or b"0"))
+
+
+def _scan_cbr_rates(content):
+    """
+    Быстрый разбор XML_daily.asp по байтам. Возвращает None, если формат документа неожиданный.
+    """
+    if b"<ValCurs" not in content[:512]:
+        return None
+    matches = _CBR_VALUTE_RE.findall(content)
+    if len(matches) != content.count(b"<Valute"):
+        return None
+
+    slots = [0]
+    values = [1.0]
+    for code, nominal, whole, fraction in matches:
+        code = code.decode("ascii")
+        slot = CURRENCY_INDEX.get(code)
+        slots.append(slot if slot is not None else currency_slot(code))
+        values.append(_scan_value(nominal, whole, fraction))
+
+    published = _CBR_DATE_RE.search(content, 0, 512)
+    day = date_cls(int(published[3]), int(published[2]), int(published[1])) if published else None
+    return slots, values, day
+
+
+def parse_cbr_rates(content):
+    """
+    Разбирает XML_daily.asp (bytes или str) в RateTable. RUB всегда равен 1.
+    """
+    with metrics.timer("parse"):
+        return _parse_cbr_rates(content)
+
+
+def _parse_cbr_rates(content):
+    parsed = _scan_cbr_rates(content) if isinstance(content, bytes) else None
+    if parsed is None:
+        slots = [0]
+        values = [1.0]
+
+        def on_valute(attrs, fields):
+            slots.append(currency_slot(fields["CharCode"]))
+            # Преобразование значений с учетом разделителя
+            values.append(int(fields["Nominal"]) / float(fields["Value"].replace(',', '.')))
+
+        published = parse_cbr_xml(content, "Valute", on_valute).get("Date")
+        parsed = slots, values, datetime.strptime(published, "%d.%m.%Y").date() if published else None
+
+    slots, values, day = parsed
+    table_values = np.full(len(CURRENCY_INDEX), np.nan)
+    table_values[slots] = values
+    return RateTable(table_values, day)
+
+
+def fetch_cbr_rates(date=None):
+    """
+    Скачивает и разбирает таблицу курсов ЦБ РФ на указанную дату.
+    """
+    url = CBR_DAILY_URL
+    if date:
+        url += f"?date_req={date.strftime('%d/%m/%Y')}"
+
+    # Выполнение HTTP-запроса к API ЦБ РФ; сегодняшняя таблица перезапрашивается условным запросом
+    response = cbr_get(url, revalidate=date is None or as_date(date) >= date_cls.today())
+    # Разбираем байты напрямую: кодировка windows-1251 указана в заголовке XML
+    return parse_daily_feed(response.content)
+
+
+def parse_daily_feed(content):
+    """
+    Разбирает таблицу курсов из ленты и пополняет по ней каталог валют.
+    """
+    table = parse_cbr_rates(content)
+    currency_catalogue.learn_feed(content, table)
+    return table
+
+
+class RateProvider(ABC):
+    """
+    Источник дневных таблиц курсов. Наследники реализуют fetch_table(date) -> RateTable
+    и сообщают об ошибке исключением.
+    """
+    name = "provider"
+
+    @abstractmethod
+    def fetch_table(self, date=None):
+        """
+        Таблица курсов на дату (None - сегодня).
+        """
+
+
+class CbrProvider(RateProvider):
+    """
+    XML_daily.asp ЦБ РФ или его зеркало с тем же форматом ответа. Об исходе запросов к самому ЦБ РФ
+    (url не задан) узнает монитор api_health.
+    """
+
+    def __init__(self, url=None, name="cbr"):
+        self.url = url
+        self.name = name
+
+    def fetch_table(self, date=None):
+        if self.url is None:
+            return fetch_cbr_rates(date)
+        params = {"date_req": date.strftime('%d/%m/%Y')} if date else None
+        response = http_fetcher.get(self.url, params, revalidate=date is None or as_date(date) >= date_cls.today())
+        response.raise_for_status()
+        return parse_daily_feed(response.content)
+
+
+class FileDropProvider(RateProvider):
+    """
+    Таблицы, выложенные в каталог файлами XML_daily_ГГГГ-ММ-ДД.xml (например, другой системой).
+    """
+
+    def __init__(self, directory, name="file"):
+        self.directory = directory
+        self.name = name
+
+    def fetch_table(self, date=None):
+        day = as_date(date)
+        with open(os.path.join(self.directory, f"XML_daily_{day.isoformat()}.xml"), "rb") as f:
+            return parse_daily_feed(f.read())
+
+
+class ProviderHealth:
+    """
+    Скользящие оценки источника: доля успешных ответов и время ответа.
+    """
+    __slots__ = ("success", "latency", "requests", "failures")
+
+    def __init__(self):
+        self.success = 1.0
+        self.latency = HEDGE_DELAY
+        self.requests = 0
+        self.failures = 0
+
+    def record(self, ok, latency):
+        self.requests += 1
+        self.failures += not ok
+        self.success += PROVIDER_HEALTH_ALPHA * ((1.0 if ok else 0.0) - self.success)
+        if ok:
+            self.latency += PROVIDER_HEALTH_ALPHA * (latency - self.latency)
+
+    def score(self):
+        return self.success / max(self.latency, 0.001)
+
+
+class ProviderPool:
+    """
+    Набор источников таблиц с хеджированием и переключением при отказах.
+    Источники перебираются по убыванию оценки здоровья (при равенстве - в порядке настройки).
+    Если лучший не ответил за hedge_delay секунд, тот же запрос отправляется следующему,
+    и используется первый успешный ответ; при ошибке сразу пробуется следующий источник.
+    """
+
+    def __init__(self, providers, hedge_delay=HEDGE_DELAY):
+        self.providers = list(providers)
+        self.hedge_delay = hedge_delay
+        self.health = {provider.name: ProviderHealth() for provider in self.providers}
+        self._lock = threading.Lock()
+        self._executor = None
+        self.hedged = 0
+        self.failovers = 0
+
+    def ranked(self):
+        with self._lock:
+            return sorted(self.providers, key=lambda provider: -self.health[provider.name].score())
+
+    def _call(self, provider, date):
+        start = time.perf_counter()
+        try:
+            table = provider.fetch_table(date)
+        except Exception:
+            with self._lock:
+                self.health[provider.name].record(False, time.perf_counter() - start)
+            metrics.inc("provider_requests_total", provider=provider.name, result="error")
+            raise
+        with self._lock:
+            self.health[provider.name].record(True, time.perf_counter() - start)
+        metrics.inc("provider_requests_total", provider=provider.name, result="ok")
+        return table
+
+    def _call_in_pool(self, provider, date, context):
+        # Поток пула выполняет запросы разных вызывающих: хедж упреждающей загрузки тоже уступает
+        # пользователю, а его трафик списывается с бюджета вызвавшего потока
+        with HttpFetcher.bind_thread(context):
+            return self._call(provider, date)
+
+    def fetch(self, date=None):
+        """
+        Таблица курсов на дату от первого успешно ответившего источника.
+        Если отказали все, выбрасывается ошибка лучшего из них.
+        """
+        ranked = self.ranked()
+        if len(ranked) == 1:
+            return self._call(ranked[0], date)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="cbr-provider")
+        remaining = iter(ranked)
+        pending = {}
+        errors = {}  # источник -> ошибка
+        context = HttpFetcher.thread_context()
+
+        def launch():
+            provider = next(remaining, None)
+            if provider is not None:
+                pending[self._executor.submit(self._call_in_pool, provider, date, context)] = provider
+            return provider is not None
+
+        launch()
+        exhausted = False
+        while pending:
+            done, _ = wait(pending, timeout=None if exhausted else self.hedge_delay, return_when=FIRST_COMPLETED)
+            if not done:
+                # Ответа нет дольше hedge_delay: дублируем запрос к следующему источнику
+                exhausted = not launch()
+                if not exhausted:
+                    self.hedged += 1
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors[provider] = e
+                    if launch():
+                        self.failovers += 1
+                    else:
+                        exhausted = True
+        raise next(errors[provider] for provider in ranked if provider in errors)
+
+    def stats(self):
+        with self._lock:
+            return {"hedged": self.hedged, "failovers": self.failovers,
+                    "providers": {name: {"requests": health.requests, "failures": health.failures,
+                                         "success": round(health.success, 3),
+                                         "latency_ms": round(health.latency * 1000, 1)}
+                                  for name, health in self.health.items()}}
+
+
+def default_providers():
+    """
+    ЦБ РФ, затем зеркала из CBR_MIRROR_URLS и каталог из CBR_DROP_DIR, если они заданы.
+    """
+    providers = [CbrProvider()]
+    mirrors = [url.strip() for url in os.environ.get(MIRROR_URLS_ENV, "").split(",") if url.strip()]
+    providers += [CbrProvider(url, name=f"mirror{i}") for i, url in enumerate(mirrors, 1)]
+    if os.environ.get(DROP_DIR_ENV):
+        providers.append(FileDropProvider(os.environ[DROP_DIR_ENV]))
+    return providers
+
+
+class RateStore:
+    """
+    Локальная история курсов в SQLite: курсы по (валюта, дата), полные дневные таблицы,
+    отметки о днях, уже синхронизированных через XML_dynamic.asp, календарь дат публикации
+    и каталог валют из ленты.
+    Подключение к базе открывается при первом обращении.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rates (
+            code TEXT NOT NULL,
+            day TEXT NOT NULL,
+            per_rub REAL NOT NULL,
+            PRIMARY KEY (code, day)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS rates_by_day ON rates (day, code);
+        CREATE TABLE IF NOT EXISTS tables (
+            day TEXT PRIMARY KEY,
+            fetched_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS synced (
+            code TEXT NOT NULL,
+            day TEXT NOT NULL,
+            PRIMARY KEY (code, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS calendar (
+            day TEXT PRIMARY KEY,
+            published TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS currencies (
+            code TEXT PRIMARY KEY,
+            name TEXT,
+            num_code TEXT,
+            cbr_id TEXT
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=RATE_STORE_FILE):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+        self._synced_at = {}  # код -> время последней синхронизации динамики (для сегодняшних дней)
+
+    def _db(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            if self.path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(self.SCHEMA)
+        return self._connection
+
+    def save_table(self, day, rates, fetched_at):
+        """
+        Сохраняет полную дневную таблицу курсов.
+        """
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO rates VALUES (?, ?, ?)",
+                               [(code, day.isoformat(), per_rub) for code, per_rub in rates.items()])
+                db.execute("INSERT OR REPLACE INTO tables VALUES (?, ?)", (day.isoformat(), fetched_at))
+
+    def load_table(self, day):
+        """
+        Возвращает (время загрузки, RateTable) или None, если таблицы на эту дату нет.
+        """
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT fetched_at FROM tables WHERE day = ?", (day.isoformat(),)).fetchone()
+            if row is None:
+                return None
+            rates = dict(db.execute("SELECT code, per_rub FROM rates WHERE day = ?", (day.isoformat(),)))
+        return row[0], RateTable.from_dict(rates)
+
+    def save_series(self, code, start, end, series):
+        """
+        Сохраняет динамику курса валюты и отмечает как синхронизированные прошедшие дни периода
+        и дни до последней опубликованной записи. Остальные дни не запрашиваются повторно в течение TODAY_RATES_TTL.
+        """
+        today = date_cls.today()
+        last = max(series, default=today - timedelta(days=1))
+        days = (start + timedelta(days=i) for i in range((end - start).days + 1))
+        covered = [(code, day.isoformat()) for day in days if day < today or day <= last]
+        with self._lock:
+            if end >= today:
+                self._synced_at[code] = time.time()
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO rates VALUES (?, ?, ?)",
+                               [(code, day.isoformat(), per_rub) for day, per_rub in series.items()])
+                db.executemany("INSERT OR IGNORE INTO synced VALUES (?, ?)", covered)
+
+    def missing_days(self, code, start, end):
+        """
+        Дни периода, по которым для валюты еще нет ни синхронизированной динамики, ни дневной таблицы.
+        Сегодняшний и будущие дни пропускаются, если динамика валюты запрашивалась не дольше TODAY_RATES_TTL назад.
+        """
+        today = date_cls.today()
+        if time.time() - self._synced_at.get(code, 0) < TODAY_RATES_TTL:
+            end = min(end, today - timedelta(days=1))
+        with self._lock:
+            db = self._db()
+            known = {row[0] for row in db.execute(
+                "SELECT day FROM synced WHERE code = ? AND day BETWEEN ? AND ?",
+                (code, start.isoformat(), end.isoformat()))}
+            tables = db.execute("SELECT day, fetched_at FROM tables WHERE day BETWEEN ? AND ?",
+                                (start.isoformat(), end.isoformat())).fetchall()
+        # Таблица, загруженная раньше своей даты, могла оказаться таблицей предыдущего дня
+        known.update(day for day, fetched_at in tables if fetched_at >= day_start(date_cls.fromisoformat(day)))
+        days = (start + timedelta(days=i) for i in range((end - start).days + 1))
+        return [day for day in days if day.isoformat() not in known]
+
+    def history(self, code, start, end):
+        """
+        Курсы валюты за период в виде двух непрерывных массивов: даты (datetime64[D]) и единиц валюты за 1 рубль.
+        """
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT day, per_rub FROM rates WHERE code = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (code, start.isoformat(), end.isoformat())).fetchall()
+        dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+        values = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        return dates, values
+
+    def history_matrix(self, codes, start, end):
+        """
+        Курсы нескольких валют за период одним запросом: даты (datetime64[D]), в которые есть курс
+        хотя бы одной из валют, и матрица [дата, валюта] единиц валюты за 1 рубль (NaN - курса нет).
+        Рубль в базе не хранится, его столбец равен 1.
+        """
+        codes = list(codes)
+        placeholders = ", ".join("?" * len(codes))
+        with self._lock:
+            rows = self._db().execute(
+                f"SELECT day, code, per_rub FROM rates WHERE code IN ({placeholders}) AND day BETWEEN ? AND ?",
+                (*codes, start.isoformat(), end.isoformat())).fetchall()
+        column = {code: i for i, code in enumerate(codes)}
+        dates, row_index = np.unique(np.array([row[0] for row in rows], dtype="datetime64[D]"), return_inverse=True)
+        values = np.full((len(dates), len(codes)), np.nan)
+        values[row_index, [column[row[1]] for row in rows]] = [row[2] for row in rows]
+        if "RUB" in column:
+            values[:, column["RUB"]] = 1.0
+        return dates, values
+
+    def save_calendar(self, days):
+        """
+        Сохраняет пары (дата, дата публикации действующей на нее таблицы).
+        """
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO calendar VALUES (?, ?)",
+                               [(day.isoformat(), published.isoformat()) for day, published in days])
+
+    def load_calendar(self):
+        """
+        Весь календарь: {дата: дата публикации}.
+        """
+        with self._lock:
+            rows = self._db().execute("SELECT day, published FROM calendar").fetchall()
+        return {date_cls.fromisoformat(day): date_cls.fromisoformat(published) for day, published in rows}
+
+    def save_currencies(self, currencies):
+        """
+        Сохраняет сведения о валютах (CurrencyInfo).
+        """
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO currencies VALUES (?, ?, ?, ?)",
+                               [(info.code, info.name, info.num_code, info.cbr_id) for info in currencies])
+
+    def load_currencies(self):
+        """
+        Сохраненный каталог: список (код, название, цифровой код, код ЦБ РФ).
+        """
+        with self._lock:
+            return self._db().execute("SELECT code, name, num_code, cbr_id FROM currencies ORDER BY code").fetchall()
+
+    def export_tables(self):
+        """
+        Все полные дневные таблицы одной матрицей: (даты datetime64[D], время загрузки, коды валют,
+        массив дни x валюты с единицами валюты за 1 рубль, NaN - курса нет).
+        """
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT tables.day, tables.fetched_at, rates.code, rates.per_rub "
+                "FROM tables JOIN rates ON rates.day = tables.day ORDER BY tables.day").fetchall()
+        days, row_index = np.unique(np.array([row[0] for row in rows], dtype="datetime64[D]"), return_inverse=True)
+        codes, column_index = np.unique(np.array([row[2] for row in rows], dtype=str), return_inverse=True)
+        values = np.full((len(days), len(codes)), np.nan)
+        values[row_index, column_index] = [row[3] for row in rows]
+        fetched_at = np.zeros(len(days))
+        fetched_at[row_index] = [row[1] for row in rows]
+        return days, fetched_at, codes.tolist(), values
+
+
+class CurrencyInfo:
+    """
+    Сведения о валюте из ленты ЦБ РФ.
+    """
+    __slots__ = ("code", "name", "num_code", "cbr_id", "flag")
+
+    def __init__(self, code, name=None, num_code=None, cbr_id=None):
+        self.code = code
+        self.name = name
+        self.num_code = num_code
+        self.cbr_id = cbr_id
+        self.flag = CURRENCY_FLAG_FILES.get(code)
+
+
+def parse_cbr_catalogue(content):
+    """
+    Сведения о всех валютах из XML_daily.asp: список CurrencyInfo.
+    """
+    currencies = []
+    parse_cbr_xml(content, "Valute", lambda attrs, fields: currencies.append(
+        CurrencyInfo(fields["CharCode"], fields.get("Name"), fields.get("NumCode"), attrs.get("ID"))))
+    return currencies
+
+
+class CurrencyCatalogue:
+    """
+    Каталог валют, доступных для выбора: сначала привычные CURRENCY_CODES, затем остальные валюты
+    из ленты ЦБ РФ по алфавиту. Сведения индексированы по коду валюты и хранятся в RateStore,
+    поэтому полный каталог доступен сразу после запуска. version растет при каждом пополнении.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.version = 0
+        self._entries = None  # код -> CurrencyInfo; загружается при первом обращении
+        self._named = np.zeros(0, dtype=bool)  # Позиции CURRENCY_INDEX, для которых сведения уже есть
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        self._entries = {"RUB": CurrencyInfo("RUB", "Российский рубль", "643")}
+        for code in CURRENCY_CODES:
+            self._entries.setdefault(code, CurrencyInfo(code, cbr_id=CBR_CURRENCY_IDS.get(code)))
+        try:
+            rows = self.store.load_currencies() if self.store is not None else []
+        except sqlite3.Error as e:
+            logging.warning(f"Ошибка чтения каталога валют: {e}")
+            rows = []
+        for row in rows:
+            self._entries[row[0]] = CurrencyInfo(*row)
+        self._mark_named(code for code, info in self._entries.items() if info.name)
+        return self._entries
+
+    def _mark_named(self, codes):
+        slots = [currency_slot(code) for code in codes]
+        if slots and max(slots) >= len(self._named):
+            self._named = np.concatenate((self._named, np.zeros(max(slots) + 1 - len(self._named), dtype=bool)))
+        self._named[slots] = True
+
+    def codes(self):
+        with self._lock:
+            entries = self._load()
+            extra = sorted(code for code in entries if code not in CURRENCY_CODES)
+            return CURRENCY_CODES + extra
+
+    def get(self, code):
+        with self._lock:
+            return self._load().get(code)
+
+    def cbr_id(self, code):
+        info = self.get(code)
+        return info.cbr_id if info else None
+
+    def learn_feed(self, content, table):
+        """
+        Пополняет каталог по ответу XML_daily.asp, если в таблице есть валюты без сведений.
+        Обычно проверка сводится к одному сравнению массивов, и лента повторно не разбирается.
+        """
+        with self._lock:
+            self._load()
+            named = self._named[:len(table.values)]
+            if len(named) == len(table.values) and np.all(named | np.isnan(table.values)):
+                return
+        try:
+            currencies = parse_cbr_catalogue(content)
+        except ET.ParseError:
+            return
+        with self._lock:
+            new = [info for info in currencies
+                   if info.code not in self._entries or self._entries[info.code].name != info.name]
+            for info in new:
+                self._entries[info.code] = info
+            self._mark_named(info.code for info in currencies)
+            if new:
+                self.version += 1
+        if new and self.store is not None:
+            try:
+                self.store.save_currencies(new)
+            except sqlite3.Error as e:
+                logging.warning(f"Не удалось сохранить каталог валют: {e}")
+
+
+class PublicationCalendar:
+    """
+    Календарь дат публикации: на выходные и праздники ЦБ РФ отдает таблицу последней даты публикации
+    (она указана в атрибуте Date ответа). Календарь сопоставляет любой дате дату действующей таблицы,
+    чтобы одна и та же таблица загружалась один раз. Заполняется по ответам сервера и хранится в RateStore.
+    Запоминаются только прошедшие дни: таблица на будущую дату еще может быть опубликована.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._days = None  # дата -> дата публикации; загружается из базы при первом обращении
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._days is None:
+            try:
+                self._days = self.store.load_calendar() if self.store is not None else {}
+            except sqlite3.Error as e:
+                logging.warning(f"Ошибка чтения календаря дат публикации: {e}")
+                self._days = {}
+        return self._days
+
+    def canonical(self, date, load=True):
+        """
+        Дата публикации таблицы, действующей в этот день, или None, если она еще неизвестна.
+        load=False - не читать базу, если календарь еще не загружен (для вызовов из интерфейса).
+        """
+        with self._lock:
+            days = self._load() if load else self._days
+            return days.get(as_date(date)) if days else None
+
+    def learn(self, pairs):
+        """
+        Запоминает пары (дата, дата публикации); будущие и сегодняшние даты пропускаются.
+        """
+        today = date_cls.today()
+        new = [(day, published) for day, published in pairs if day < today and published <= day]
+        if not new:
+            return
+        with self._lock:
+            days = self._load()
+            new = [(day, published) for day, published in new if days.get(day) != published]
+            days.update(new)
+        if new and self.store is not None:
+            try:
+                self.store.save_calendar(new)
+            except sqlite3.Error as e:
+                logging.warning(f"Не удалось сохранить календарь дат публикации: {e}")
+
+    def learn_series(self, start, end, published_days):
+        """
+        Запоминает календарь периода по датам записей динамики: каждой дате соответствует
+        последняя дата публикации не позже нее. Дни до первой записи периода остаются неизвестными.
+        """
+        published_days = sorted(day for day in published_days if start <= day <= end)
+        if not published_days:
+            return
+        pairs = []
+        current, following = published_days[0], iter(published_days[1:] + [None])
+        upcoming = next(following)
+        day = current
+        while day <= end:
+            if upcoming is not None and day >= upcoming:
+                current, upcoming = upcoming, next(following)
+            pairs.append((day, current))
+            day += timedelta(days=1)
+        self.learn(pairs)
+
+
+class RateSnapshot:
+    """
+    Двоичный снимок всех известных таблиц курсов для работы без сети.
+    Формат файла: MAGIC, длина заголовка (uint64), JSON-заголовок {codes, rows, created_at}, затем
+    массивы days (int64, дни от 1970-01-01 по возрастанию), fetched_at (float64) и
+    values (float64, rows x codes, единиц валюты за 1 рубль). Файл отображается в память целиком,
+    поэтому загрузка не требует разбора, а таблица на дату собирается из одной строки матрицы.
+    """
+    MAGIC = b"CBRSNAP1"
+
+    def __init__(self, path=RATE_SNAPSHOT_FILE):
+        self.path = path
+        self.served_days = set()  # Даты, на которые курс выдан из снимка без сети; меняется под _served_lock
+        self._served_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self.codes = []
+        self.created_at = None
+        self.days = np.empty(0, dtype=np.int64)
+        self.fetched_at = np.empty(0)
+        self.values = np.empty((0, 0))
+        self._slots = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def write(cls, path, days, fetched_at, codes, values, created_at=None):
+        """
+        Записывает снимок атомарно: во временный файл, затем замена.
+        """
+        header = json.dumps({"codes": list(codes), "rows": len(days),
+                             "created_at": created_at or time.time()}).encode("utf-8")
+        header += b" " * (-len(header) % 8)  # Массивы после заголовка выровнены на 8 байт
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(cls.MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            f.write(np.asarray(days, dtype="datetime64[D]").astype("<i8").tobytes())
+            f.write(np.asarray(fetched_at, dtype="<f8").tobytes())
+            f.write(np.ascontiguousarray(values, dtype="<f8").tobytes())
+        os.replace(temp_path, path)
+
+    def load(self):
+        """
+        Отображает файл снимка в память при первом обращении. Отсутствующий или испорченный файл - пустой снимок.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    self._open()
+                except FileNotFoundError:
+                    pass
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Снимок курсов {self.path} не прочитан: {e}")
+        return self
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError("неизвестный формат файла")
+            header_size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_size))
+        rows, codes = header["rows"], header["codes"]
+        if not rows:
+            return
+        raw = np.memmap(self.path, dtype=np.uint8, mode="r")
+        offset = len(self.MAGIC) + 8 + header_size
+        sizes = (rows * 8, rows * 8, rows * len(codes) * 8)
+        if len(raw) < offset + sum(sizes):
+            raise ValueError("файл обрезан")
+        self.days = raw[offset:offset + sizes[0]].view("<i8")
+        self.fetched_at = raw[offset + sizes[0]:offset + sizes[0] + sizes[1]].view("<f8")
+        self.values = raw[offset + sizes[0] + sizes[1]:offset + sum(sizes)].view("<f8").reshape(rows, len(codes))
+        self.codes = codes
+        self.created_at = header["created_at"]
+        self._slots = np.array([currency_slot(code) for code in codes], dtype=np.int64)
+
+    def _row_table(self, row):
+        values = np.full(len(CURRENCY_INDEX), np.nan)
+        values[self._slots] = self.values[row]  # Копия строки: таблица не держит ссылку на файл
+        return RateTable(values)
+
+    def table(self, date):
+        """
+        (время загрузки, RateTable) ровно на эту дату или None.
+        """
+        self.load()
+        day = np.datetime64(as_date(date), "D").astype(np.int64)
+        row = int(np.searchsorted(self.days, day))
+        if row < len(self.days) and self.days[row] == day:
+            return float(self.fetched_at[row]), self._row_table(row)
+        return None
+
+    def nearest(self, date):
+        """
+        (дата таблицы, RateTable) - последняя известная таблица не позже даты или None.
+        """
+        self.load()
+        row = int(np.searchsorted(self.days, np.datetime64(as_date(date), "D").astype(np.int64), "right")) - 1
+        if row < 0:
+            return None
+        return np.datetime64(int(self.days[row]), "D").astype(object), self._row_table(row)
+
+    def save_from(self, store):
+        """
+        Дополняет снимок всеми полными таблицами из RateStore. Таблицы снимка, которых нет в базе
+        (например, загруженные командой backfill), сохраняются; на совпадающие даты берется таблица из базы.
+        """
+        self.load()
+        days, fetched_at, codes, values = store.export_tables()
+        with self._lock:
+            days, fetched_at, codes, values = self._merge(days, fetched_at, codes, values)
+            self._reset()  # Отображение старого файла освобождается до замены (важно для Windows)
+            self.write(self.path, days, fetched_at, codes, values)
+        logging.info(f"Снимок курсов обновлен: {len(days)} таблиц.")
+
+    def _merge(self, days, fetched_at, codes, values):
+        # Строки снимка копируются из отображения, поэтому результат не зависит от старого файла
+        days = np.asarray(days, dtype="datetime64[D]").astype(np.int64)
+        kept = ~np.isin(self.days, days)
+        if not kept.any():
+            return days.astype("datetime64[D]"), fetched_at, codes, values
+        all_codes = sorted(set(codes) | set(self.codes))
+        column = {code: i for i, code in enumerate(all_codes)}
+        merged = np.full((kept.sum() + len(days), len(all_codes)), np.nan)
+        merged[:kept.sum(), [column[code] for code in self.codes]] = self.values[kept]
+        merged[kept.sum():, [column[code] for code in codes]] = values
+        all_days = np.concatenate([self.days[kept], days])
+        order = np.argsort(all_days, kind="stable")
+        return (all_days[order].astype("datetime64[D]"), np.concatenate([self.fetched_at[kept], fetched_at])[order],
+                all_codes, merged[order])
+
+    def mark_served(self, date):
+        """
+        Запоминает дату, курс на которую выдан из снимка, для сверки после восстановления связи.
+        """
+        with self._served_lock:
+            self.served_days.add(as_date(date))
+
+    def reconcile(self, cache, store):
+        """
+        После восстановления связи заново загружает таблицы, выданные из снимка, и обновляет снимок.
+        """
+        if not self.served_days or not self._reconcile_lock.acquire(blocking=False):
+            return
+        try:
+            with self._served_lock:
+                days = sorted(self.served_days)
+            for day in days:
+                try:
+                    cache.get(day)
+                    with self._served_lock:
+                        self.served_days.discard(day)
+                except Exception as e:
+                    logging.warning(f"Сверка курсов на {day} не удалась: {e}")
+                    return
+            self.save_from(store)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Не удалось обновить снимок курсов: {e}")
+        finally:
+            self._reconcile_lock.release()
+
+
+class RateCache:
+    """
+    Кэш таблиц курсов по дате публикации: LRU в памяти, затем снимок RateSnapshot и локальная база RateStore.
+    Прошлые даты, загруженные после публикации, не перезапрашиваются никогда, сегодняшняя таблица - по истечении TTL.
+    Дата запроса сводится к дате публикации по календарю, поэтому выходные используют уже загруженную таблицу.
+    """
+
+    def __init__(self, max_entries=RATE_CACHE_SIZE, store=None, today_ttl=TODAY_RATES_TTL,
+                 fetcher=fetch_cbr_rates, snapshot=None, calendar=None):
+        self.max_entries = max_entries
+        self.store = store
+        self.snapshot = snapshot
+        self.calendar = calendar
+        self.today_ttl = today_ttl
+        self.fetcher = fetcher
+        self._entries = OrderedDict()  # date -> (время загрузки, словарь курсов)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _is_fresh(self, day, fetched_at):
+        # Таблица, загруженная не раньше своей даты, уже опубликована и не меняется;
+        # более ранняя загрузка (таблица на завтра) и сегодняшняя таблица живут TTL
+        if day < date_cls.today() and fetched_at >= day_start(day):
+            return True
+        return time.time() - fetched_at < self.today_ttl
+
+    def _is_usable_offline(self, day, fetched_at):
+        # Без сети годится и таблица с истекшим TTL, если она загружена не раньше своей даты
+        return self._is_fresh(day, fetched_at) or fetched_at >= day_start(day)
+
+    def _load_from_disk(self, day, usable):
+        if self.snapshot is not None:
+            entry = self.snapshot.table(day)
+            if entry and usable(day, entry[0]):
+                return entry
+        if self.store is None:
+            return None
+        try:
+            return self.store.load_table(day)
+        except sqlite3.Error as e:
+            logging.warning(f"Ошибка чтения локальной базы курсов: {e}")
+            return None
+
+    def _save_to_disk(self, day, fetched_at, rates):
+        if self.store is None:
+            return
+        try:
+            self.store.save_table(day, rates, fetched_at)
+        except sqlite3.Error as e:
+            logging.warning(f"Не удалось сохранить курсы в локальную базу: {e}")
+
+    def _remember(self, day, fetched_at, rates):
+        self._entries[day] = (fetched_at, rates)
+        self._entries.move_to_end(day)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def peek(self, date=None):
+        """
+        Возвращает словарь курсов, только если он уже есть в памяти и не устарел. Не обращается к диску и сети.
+        """
+        day = as_date(date)
+        canonical = self.calendar.canonical(day, load=False) if self.calendar is not None else None
+        with self._lock:
+            for key in (day, canonical):
+                entry = self._entries.get(key)
+                if entry and self._is_fresh(key, entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.inc("cache_lookups_total", result="memory")
+                    return entry[1]
+        return None
+
+    def _keys(self, date):
+        day = as_date(date)
+        canonical = self.calendar.canonical(day) if self.calendar is not None else None
+        return (day,) if canonical in (None, day) else (day, canonical)
+
+    def _find(self, keys, usable):
+        # Память проверяется под self._lock, а снимок и локальная база - без него,
+        # чтобы peek() из потока интерфейса не ждал чтения с диска
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and usable(key, entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.inc("cache_lookups_total", result="memory")
+                    return entry[1]
+
+        for key in keys:
+            entry = self._load_from_disk(key, usable)
+            if entry and usable(key, entry[0]):
+                with self._lock:
+                    self._remember(key, *entry)
+                    self.disk_hits += 1
+                metrics.inc("cache_lookups_total", result="disk")
+                return entry[1]
+        return None
+
+    def lookup(self, date=None):
+        """
+        Возвращает словарь курсов из памяти или с диска без обращения к сети, либо None.
+        Подходят и таблицы с истекшим TTL, если они загружены не раньше своей даты.
+        """
+        return self._find(self._keys(date), self._is_usable_offline)
+
+    def get(self, date=None):
+        """
+        Возвращает словарь курсов на дату, при необходимости скачивая его.
+        """
+        day = as_date(date)
+        keys = self._keys(day)
+        with metrics.timer("cache_lookup"):
+            rates = self._find(keys, self._is_fresh)
+            if rates is not None:
+                return rates
+            with self._lock:
+                self.misses += 1
+            metrics.inc("cache_lookups_total", result="miss")
+
+        # Сеть запрашиваем вне блокировки, чтобы не тормозить остальные даты
+        rates = self.fetcher(keys[-1])
+        fetched_at = time.time()
+        published = getattr(rates, "date", None)
+        if self.calendar is not None and published is not None:
+            self.calendar.learn([(day, published)])
+        # Таблица хранится только под датой публикации, тогда все дни, где она действует, найдут ее без запроса.
+        # До публикации ЦБ РФ отвечает на будущую дату последней таблицей: такой ответ держится
+        # в памяти под запрошенной датой до истечения TTL, но на диск не попадает
+        key = published if published is not None else day
+        with self._lock:
+            self._remember(key, fetched_at, rates)
+            if key != day and day >= date_cls.today():
+                self._remember(day, fetched_at, rates)
+        if published is not None or day < date_cls.today():
+            self._save_to_disk(key, fetched_at, rates)
+        return rates
+
+    def stats(self):
+        """
+        Счетчики попаданий и промахов кэша.
+        """
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "entries": len(self._entries)}
+
+    def clear(self):
+        """
+        Очищает кэш в памяти (файлы на диске остаются).
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+rate_store = RateStore()
+rate_snapshot = RateSnapshot()
+publication_calendar = PublicationCalendar(rate_store)
+currency_catalogue = CurrencyCatalogue(rate_store)
+rate_providers = ProviderPool(default_providers())
+rate_cache = RateCache(store=rate_store, snapshot=rate_snapshot, calendar=publication_calendar,
+                       fetcher=rate_providers.fetch)
+
+
+def fetch_rates_many(dates, max_workers=FETCH_WORKERS):
+    """
+    Загружает таблицы курсов на несколько дат параллельно через rate_cache.
+    Даты сводятся к датам публикации, и каждая таблица запрашивается один раз. Если календарь
+    для многих дат неизвестен, он сначала уточняется одним запросом динамики.
+    Возвращает словарь {дата: курсы}; даты, которые не удалось загрузить, пропускаются.
+    """
+    days = list(dict.fromkeys(as_date(day) for day in dates))
+    unknown = [day for day in days if day < date_cls.today() and publication_calendar.canonical(day) is None]
+    if len(unknown) >= CALENDAR_PROBE_MIN_DAYS:
+        try:
+            sync_history((CALENDAR_CURRENCY,), min(unknown), max(unknown))
+        except (requests.RequestException, ET.ParseError, ValueError, sqlite3.Error) as e:
+            logging.warning(f"Календарь дат публикации не уточнен: {e}")
+
+    canonical = {day: publication_calendar.canonical(day) or day for day in days}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cbr-fetch") as executor:
+        futures = {published: executor.submit(rate_cache.get, published) for published in set(canonical.values())}
+        for day in days:
+            try:
+                results[day] = futures[canonical[day]].result()
+            except Exception as e:
+                logging.error(f"Ошибка получения курсов на {day.strftime('%d.%m.%Y')}: {e}")
+    return results
+
+
+class PrefetchScheduler:
+    """
+    Фоновая упреждающая загрузка: таблица на следующий день после ее публикации,
+    соседние с выбранной даты и история для графика выбранной пары.
+    Задачи выполняются в порядке приоритета не более чем в PREFETCH_WORKERS потоков и в пределах
+    бюджета трафика. Потоки помечены как фоновые, поэтому запросы пользователя их опережают,
+    а пока выполняется задача пользователя (foreground()), новые задачи не начинаются.
+    """
+    NEXT_DAY, NEIGHBOURS, CHART = range(3)  # Приоритеты задач, меньше - раньше
+
+    def __init__(self, workers=PREFETCH_WORKERS, bytes_per_second=PREFETCH_BYTES_PER_SECOND,
+                 next_day_interval=PREFETCH_NEXT_DAY_INTERVAL):
+        self.workers = workers
+        self.bytes_per_second = bytes_per_second
+        self.next_day_interval = next_day_interval
+        self._queue = queue.PriorityQueue()
+        self._queued = set()  # Ключи задач в очереди или в работе
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._budget = float(bytes_per_second)  # Байт, которые можно скачать прямо сейчас
+        self._budget_at = time.monotonic()
+        self._published_day = None  # Последний день, таблица на который уже получена заранее
+        self._foreground = 0  # Сколько задач пользователя выполняется сейчас
+        self._foreground_done = threading.Condition(self._lock)
+        self._threads = []
+        self.completed = 0
+        self.failed = 0
+        self.bytes_used = 0
+
+    def submit(self, priority, key, fn, *args):
+        """
+        Ставит задачу в очередь, если задачи с таким ключом там еще нет.
+        """
+        with self._lock:
+            if key in self._queued:
+                return False
+            self._queued.add(key)
+        self._queue.put((priority, next(self._counter), key, fn, args))
+        return True
+
+    @contextlib.contextmanager
+    def foreground(self):
+        """
+        Приостанавливает запуск новых фоновых задач на время задачи пользователя,
+        чтобы они не отнимали у нее и у потока интерфейса процессорное время.
+        """
+        with self._lock:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+                if not self._foreground:
+                    self._foreground_done.notify_all()
+
+    def _wait_for_foreground(self):
+        with self._lock:
+            while self._foreground:
+                self._foreground_done.wait()
+
+    def prefetch_neighbours(self, date, radius=PREFETCH_NEIGHBOUR_DAYS):
+        """
+        Загружает таблицы на даты вокруг выбранной, ближние - раньше дальних.
+        """
+        day = as_date(date)
+        tomorrow = date_cls.today() + timedelta(days=1)
+        for offset in sorted(range(-radius, radius + 1), key=abs):
+            neighbour = day + timedelta(days=offset)
+            if neighbour <= tomorrow and rate_cache.peek(neighbour) is None:
+                self.submit(self.NEIGHBOURS, ("table", neighbour), rate_cache.get, neighbour)
+
+    def prefetch_chart(self, from_currency, to_currency):
+        """
+        Догружает историю пары за период графика, чтобы show_chart читал ее из локальной базы.
+        """
+        today = date_cls.today()
+        start = today - timedelta(days=CHART_HISTORY_DAYS - 1)
+        self.submit(self.CHART, ("history", from_currency, to_currency),
+                    sync_history, (from_currency, to_currency), start, today)
+
+    def prefetch_next_day(self):
+        """
+        После часа публикации загружает таблицу на завтра; пока ЦБ РФ ее не опубликовал,
+        в ответе приходит сегодняшняя таблица (rate_cache не сохраняет ее под завтрашней датой),
+        и попытка повторится через next_day_interval.
+        """
+        tomorrow = date_cls.today() + timedelta(days=1)
+        if self._published_day == tomorrow or datetime.now().hour < CBR_PUBLISH_HOUR:
+            return
+        self.submit(self.NEXT_DAY, ("next_day", tomorrow), self._fetch_next_day, tomorrow)
+
+    def _fetch_next_day(self, day):
+        if rate_cache.get(day).date == day:
+            self._published_day = day
+            logging.info(f"Таблица курсов на {day.strftime('%d.%m.%Y')} загружена заранее.")
+
+    def _spend(self, size):
+        with self._lock:
+            self._budget -= size
+            self.bytes_used += size
+
+    def _wait_for_budget(self):
+        # Бюджет пополняется со скоростью bytes_per_second, но не больше чем на секунду вперед
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._budget = min(self._budget + (now - self._budget_at) * self.bytes_per_second,
+                                   float(self.bytes_per_second))
+                self._budget_at = now
+                if self._budget >= 0:
+                    return
+                delay = -self._budget / self.bytes_per_second
+            time.sleep(delay)
+
+    def _work(self):
+        HttpFetcher.mark_background()
+        while True:
+            priority, _, key, fn, args = self._queue.get()
+            self._wait_for_foreground()
+            if not api_health.is_available():
+                with self._lock:
+                    self._queued.discard(key)  # Без сети задача отбрасывается, ее поставят заново
+                continue
+            self._wait_for_budget()
+            received = HttpFetcher.thread_bytes_received()
+            try:
+                fn(*args)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.warning(f"Упреждающая загрузка {key} не удалась: {e}")
+            finally:
+                self._spend(HttpFetcher.thread_bytes_received() - received)
+                with self._lock:
+                    self._queued.discard(key)
+
+    def _plan(self):
+        while True:
+            self.prefetch_next_day()
+            time.sleep(self.next_day_interval)
+
+    def start(self):
+        """
+        Запускает фоновые потоки (повторный вызов ничего не делает).
+        """
+        if self._threads:
+            return
+        self._threads = [threading.Thread(target=self._work, name=f"cbr-prefetch-{i}", daemon=True)
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._plan, name="cbr-prefetch-plan", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "completed": self.completed, "failed": self.failed,
+                "bytes": self.bytes_used}
+
+
+prefetcher = PrefetchScheduler()
+
+
+# Функция для получения курса валют с сайта ЦБ РФ
+def table_conversion_rate(rates, from_currency, to_currency):
+    """
+    Курс пары по уже загруженной таблице курсов.
+    """
+    # Проверка наличия требуемых валют в словаре
+    if from_currency not in rates or to_currency not in rates:
+        raise ValueError(f"Валюта {from_currency} или {to_currency} не найдена в списке.")
+
+    # Расчет курса конверсии
+    with metrics.timer("convert"):
+        return rates[to_currency] * rates["RUB"] / rates[from_currency]
+
+
+def get_cbr_exchange_rate(from_currency, to_currency, date=None):
+    """
+    Получает курс валют с сайта Центрального банка России для указанной валюты и даты.
+    Таблицы курсов берутся из rate_cache, поэтому повторные запросы не ходят в сеть.
+    В случае ошибки возвращает сообщение об ошибке.
+    """
+    try:
+        rates = rate_cache.get(date)
+        return table_conversion_rate(rates, from_currency, to_currency)
+
+    except requests.RequestException as e:
+        raise ConnectionError(f"Ошибка подключения к серверу: {e}")
+    except ET.ParseError:
+        raise ValueError("Ошибка обработки данных от сервера. Попробуйте позже.")
+    except Exception as e:
+        raise RuntimeError(f"Произошла ошибка: {e}")
+
+
+def parse_cbr_dynamic(content):
+    """
+    Разбирает XML динамики курса ЦБ РФ и возвращает словарь {дата: единиц валюты за 1 рубль}.
+    """
+    with metrics.timer("parse"):
+        return _parse_cbr_dynamic(content)
+
+
+def _parse_cbr_dynamic(content):
+    if isinstance(content, bytes) and b"<ValCurs" in content[:512]:
+        matches = _CBR_RECORD_RE.findall(content)
+        if len(matches) == content.count(b"<Record"):
+            return {date_cls(int(year), int(month), int(day)): _scan_value(nominal, whole, fraction)
+                    for day, month, year, nominal, whole, fraction in matches}
+
+    series = {}
+
+    def on_record(attrs, fields):
+        day = datetime.strptime(attrs["Date"], "%d.%m.%Y").date()
+        series[day] = int(fields["Nominal"]) / float(fields["Value"].replace(',', '.'))
+
+    parse_cbr_xml(content, "Record", on_record)
+    return series
+
+
+def currency_cbr_id(currency):
+    """
+    Код валюты в справочнике ЦБ РФ (нужен для XML_dynamic.asp). Для неизвестной валюты - ValueError.
+    """
+    cbr_id = CBR_CURRENCY_IDS.get(currency) or currency_catalogue.cbr_id(currency)
+    if not cbr_id:
+        raise ValueError(f"Для валюты {currency} неизвестен код ЦБ РФ.")
+    return cbr_id
+
+
+def fetch_cbr_dynamic(currency, start, end):
+    """
+    Скачивает динамику курса одной валюты за период одним запросом.
+    """
+    params = {
+        "date_req1": start.strftime('%d/%m/%Y'),
+        "date_req2": end.strftime('%d/%m/%Y'),
+        "VAL_NM_RQ": currency_cbr_id(currency)
+    }
+    response = cbr_get(CBR_DYNAMIC_URL, params=params)
+    return parse_cbr_dynamic(response.content)
+
+
+def sync_history(currencies, start, end, store=None):
+    """
+    Догружает в локальную базу динамику курсов только за те дни периода, которых в ней еще нет.
+    Для каждой валюты выполняется не больше одного запроса. Возвращает число выполненных запросов.
+    """
+    store = store or rate_store
+    requests_made = 0
+    for currency in dict.fromkeys(currencies):
+        if currency == "RUB":
+            continue  # Рубль в динамике не публикуется, его курс всегда 1
+        missing = store.missing_days(currency, start, end)
+        if not missing:
+            continue
+        series = fetch_cbr_dynamic(currency, missing[0], missing[-1])
+        store.save_series(currency, missing[0], missing[-1], series)
+        if currency == CALENDAR_CURRENCY:
+            publication_calendar.learn_series(missing[0], missing[-1], series.keys())
+        requests_made += 1
+    return requests_made
+
+
+def load_history(from_currency, to_currency, start, end, store=None):
+    """
+    Читает историю курса пары из локальной базы без обращения к сети.
+    Возвращает массивы дат (datetime64[D]) и курсов (float64).
+    """
+    store = store or rate_store
+    if from_currency == "RUB" and to_currency == "RUB":
+        dates = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+        return dates, np.ones(len(dates))
+    if from_currency == "RUB":
+        return store.history(to_currency, start, end)
+    if to_currency == "RUB":
+        dates, from_values = store.history(from_currency, start, end)
+        return dates, 1.0 / from_values
+
+    from_dates, from_values = store.history(from_currency, start, end)
+    to_dates, to_values = store.history(to_currency, start, end)
+    dates, from_index, to_index = np.intersect1d(from_dates, to_dates, assume_unique=True, return_indices=True)
+    return dates, to_values[to_index] / from_values[from_index]
+
+
+def get_cbr_history(from_currency, to_currency, start, end):
+    """
+    Возвращает историю курса пары за период в виде массивов дат и курсов.
+    Сначала догружает в локальную базу недостающие дни через XML_dynamic.asp (один запрос на валюту),
+    затем читает историю из базы; если догрузить не удалось, используется то, что в базе уже есть.
+    Если в базе за период ничего нет - запрашивает по отдельности каждый из последних
+    HISTORY_FALLBACK_DAYS дней периода, для неполученных дней курс равен NaN.
+    Для валюты, которой нет в справочнике ЦБ РФ, - ValueError.
+    """
+    start, end = as_date(start), as_date(end)
+    for currency in (from_currency, to_currency):
+        if currency != "RUB":
+            currency_cbr_id(currency)
+    try:
+        sync_history((from_currency, to_currency), start, end)
+    except (requests.RequestException, ET.ParseError, ValueError, sqlite3.Error) as e:
+        logging.warning(f"Динамика курса не обновлена ({e}), используем локальную базу.")
+    try:
+        dates, rates = load_history(from_currency, to_currency, start, end)
+        if len(dates):
+            return dates, rates
+    except sqlite3.Error as e:
+        logging.warning(f"Ошибка чтения локальной базы курсов: {e}")
+    logging.warning("Истории курса в локальной базе нет, запрашиваем курсы по дням.")
+
+    start = max(start, end - timedelta(days=HISTORY_FALLBACK_DAYS - 1))
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    tables = fetch_rates_many(days)  # Все дни загружаются параллельно
+    rates = np.full(len(days), np.nan)
+    for i, day in enumerate(days):
+        table = tables.get(day)
+        if table is not None and from_currency in table and to_currency in table:
+            rates[i] = table[to_currency] / table[from_currency]
+    return np.array(days, dtype="datetime64[D]"), rates
+
+
+class CrossRateMatrix:
+    """
+    Матрица кросс-курсов по одной таблице ЦБ РФ.
+    matrix[i, j] - сколько единиц codes[j] дают за одну единицу codes[i].
+    """
+
+    def __init__(self, rates, currencies=None):
+        if currencies is None:
+            currencies = sorted(rates)  # Все валюты из таблицы
+        missing = [currency for currency in currencies if currency not in rates]
+        if missing:
+            raise ValueError(f"Валюты не найдены в списке: {', '.join(missing)}")
+
+        self.codes = list(currencies)
+        self.index = {currency: i for i, currency in enumerate(self.codes)}
+        per_rub = np.array([rates[currency] for currency in self.codes], dtype=np.float64)
+        self.matrix = per_rub[np.newaxis, :] / per_rub[:, np.newaxis]
+
+    def indices(self, currencies):
+        """
+        Переводит код или массив кодов валют в индексы строк/столбцов матрицы.
+        """
+        if isinstance(currencies, str):
+            if currencies not in self.index:
+                raise ValueError(f"Валюта {currencies} не найдена в списке.")
+            return self.index[currencies]
+
+        # Словарь проходим только по уникальным кодам, а не по каждой строке
+        unique, inverse = np.unique(np.asarray(currencies), return_inverse=True)
+        missing = [str(currency) for currency in unique if currency not in self.index]
+        if missing:
+            raise ValueError(f"Валюты не найдены в списке: {', '.join(missing)}")
+        lookup = np.array([self.index[currency] for currency in unique], dtype=np.intp)
+        return lookup[inverse]
+
+    def rate(self, from_currency, to_currency):
+        """
+        Курс одной пары.
+        """
+        return float(self.matrix[self.indices(from_currency), self.indices(to_currency)])
+
+    def convert(self, amounts, from_currencies, to_currencies):
+        """
+        Конвертирует массив сумм одним векторным вызовом.
+        Валюты задаются кодом (для всех сумм) или массивом кодов той же длины.
+        """
+        with metrics.timer("convert"):
+            amounts = np.asarray(amounts, dtype=np.float64)
+            metrics.inc("amounts_converted_total", amounts.size)
+            return amounts * self.matrix[self.indices(from_currencies), self.indices(to_currencies)]
+
+
+def _window_sums(values, window):
+    """
+    Суммы по скользящему окну из window элементов через накопленные суммы: O(n) независимо от окна.
+    Для первых window - 1 элементов окно неполное, там NaN.
+    """
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    sums = np.full(len(values), np.nan)
+    sums[window - 1:] = cumulative[window:] - cumulative[:-window]
+    return sums
+
+
+def rolling_stats(rates, window=ANALYTICS_WINDOW):
+    """
+    Скользящие показатели одного ряда кросс-курса (массив по датам публикации, NaN - курса нет).
+    Значение на дату i относится к окну из window последних дат, включая i:
+    mean - средний курс, volatility - стандартное отклонение дневных логарифмических изменений,
+    low/high - минимум и максимум, change - относительное изменение от начала окна (0.01 = 1%).
+    Пропуски в окне не учитываются; пока окно неполное, значения NaN.
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    valid = np.isfinite(rates)
+    count = _window_sums(valid, window)
+    total = _window_sums(np.where(valid, rates, 0.0), window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / count, np.nan)
+
+        # Изменения за день в окне из window дат - это window - 1 изменений внутри окна
+        returns = np.diff(np.log(rates), prepend=np.nan)
+        returns_valid = np.isfinite(returns)
+        returns = np.where(returns_valid, returns, 0.0)
+        n = _window_sums(returns_valid, window - 1) if window > 1 else np.zeros(len(rates))
+        if window > 1:
+            s1 = _window_sums(returns, window - 1)
+            s2 = _window_sums(returns * returns, window - 1)
+            variance = np.maximum(s2 - s1 * s1 / n, 0.0) / (n - 1)
+            volatility = np.where(n > 1, np.sqrt(variance), np.nan)
+        else:
+            volatility = np.full(len(rates), np.nan)
+
+        low = np.full(len(rates), np.nan)
+        high = np.full(len(rates), np.nan)
+        change = np.full(len(rates), np.nan)
+        if len(rates) >= window:
+            windows = np.lib.stride_tricks.sliding_window_view(rates, window)
+            low[window - 1:] = np.fmin.reduce(windows, axis=1)  # fmin/fmax пропускают NaN
+            high[window - 1:] = np.fmax.reduce(windows, axis=1)
+            change[window - 1:] = rates[window - 1:] / rates[:len(rates) - window + 1] - 1
+    return {"mean": mean, "volatility": volatility, "low": low, "high": high, "change": change}
+
+
+def get_chart_history(from_currency, to_currency, start, end):
+    """
+    История курса пары для графика: даты, курсы и скользящие показатели (rolling_stats).
+    Показатели считаются здесь, в фоновом потоке, а не в обработчике результата в потоке интерфейса.
+    """
+    dates, rates = get_cbr_history(from_currency, to_currency, start, end)
+    return dates, rates, rolling_stats(rates)
+
+
+class RollingAnalytics:
+    """
+    Скользящие показатели сразу по всем парам валют по истории курсов к рублю.
+    Показатели пары [i, j] относятся к кросс-курсу codes[i] -> codes[j] (как в CrossRateMatrix)
+    на последнем окне из window дат публикации; смысл показателей - как в rolling_stats.
+
+    Кросс-курсы всех пар не хранятся: сумма курсов пар в окне - это произведение матриц
+    (1 / курс)^T x курс, а суммы дневных изменений и их квадратов раскладываются через
+    изменения курсов отдельных валют. Новая дата добавляет вклад новой строки и вычитает
+    вклад выпавшей (обновления ранга 1, O(валют^2)); минимум и максимум пересчитываются
+    только у пар, чей экстремум выпал из окна. Раз в window обновлений состояние
+    пересчитывается с нуля, чтобы не накапливалась ошибка округления. Окна короче
+    ANALYTICS_INCREMENTAL_MIN_WINDOW (в том числе окно по умолчанию) всегда пересчитываются с нуля:
+    там это дешевле нескольких обновлений ранга 1 и пересчета экстремумов.
+    """
+
+    def __init__(self, dates, per_rub, codes, window=ANALYTICS_WINDOW):
+        if window < 2:
+            raise ValueError("Окно скользящих показателей должно быть не меньше двух дат.")
+        self.codes = list(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.window = window
+        per_rub = np.asarray(per_rub, dtype=np.float64).reshape(-1, len(self.codes))
+        self._size = len(per_rub)
+        self._dates = np.empty(max(self._size * 2, 64), dtype="datetime64[D]")
+        self._values = np.full((len(self._dates), len(self.codes)), np.nan)
+        self._dates[:self._size] = dates
+        self._values[:self._size] = per_rub
+        self._updates = 0
+        self.recompute()
+
+    @classmethod
+    def from_store(cls, codes, start, end, store=None, window=ANALYTICS_WINDOW):
+        """
+        Строит показатели по истории из локальной базы (без обращения к сети).
+        """
+        dates, values = (store or rate_store).history_matrix(codes, as_date(start), as_date(end))
+        return cls(dates, values, codes, window)
+
+    @property
+    def dates(self):
+        return self._dates[:self._size]
+
+    @property
+    def values(self):
+        return self._values[:self._size]
+
+    @staticmethod
+    def _cross(per_rub):
+        return per_rub[np.newaxis, :] / per_rub[:, np.newaxis]
+
+    @staticmethod
+    def _parts(rows, previous):
+        """
+        Слагаемые оконных сумм для строк курсов rows и предшествующих им строк previous:
+        (1 / курс, курс, признак курса, дневное изменение, признак изменения), пропуски заменены нулями.
+        """
+        valid = np.isfinite(rows)
+        inverse = np.where(valid, 1.0 / np.where(valid, rows, 1.0), 0.0)
+        values = np.where(valid, rows, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = np.log(rows) - np.log(previous)
+        returns_valid = np.isfinite(returns)
+        returns = np.where(returns_valid, returns, 0.0)
+        return inverse, values, valid.astype(np.float64), returns, returns_valid.astype(np.float64)
+
+    def recompute(self):
+        """
+        Пересчитывает показатели последнего окна с нуля.
+        """
+        size = len(self.codes)
+        rows = self._values[max(self._size - self.window, 0):self._size]
+        previous = np.vstack((np.full((1, size), np.nan), self._values[:self._size]))
+        previous = previous[max(self._size - self.window, 0):self._size]
+        previous[0] = np.nan  # Изменение к дате перед окном в окно не входит
+        inverse, values, valid, returns, returns_valid = self._parts(rows, previous)
+
+        self._sum = inverse.T @ values
+        self._count = valid.T @ valid
+        self._returns_sum = returns_valid.T @ returns  # [i, j] - сумма изменений j за дни, где есть изменение i
+        self._squares_sum = returns_valid.T @ (returns * returns)
+        self._products_sum = returns.T @ returns
+        self._returns_count = returns_valid.T @ returns_valid
+        if len(rows):
+            crosses = rows[:, np.newaxis, :] / rows[:, :, np.newaxis]
+            self.low = np.fmin.reduce(crosses, axis=0)
+            self.high = np.fmax.reduce(crosses, axis=0)
+        else:
+            self.low = np.full((size, size), np.nan)
+            self.high = np.full((size, size), np.nan)
+        self._updates = 0
+
+    def append(self, day, rates):
+        """
+        Добавляет таблицу курсов на новую дату и обновляет показатели окна.
+        rates - RateTable/словарь {код: единиц за 1 рубль} или массив в порядке codes.
+        """
+        day = np.datetime64(as_date(day), "D")
+        if self._size and day <= self._dates[self._size - 1]:
+            raise ValueError("Дата должна быть позже последней даты в истории.")
+        if isinstance(rates, np.ndarray):
+            row = rates.astype(np.float64)
+        else:
+            row = np.array([1.0 if code == "RUB" else rates[code] if code in rates else np.nan
+                            for code in self.codes])
+        if self._size == len(self._dates):
+            self._dates = np.concatenate((self._dates, np.empty_like(self._dates)))
+            self._values = np.vstack((self._values, np.full_like(self._values, np.nan)))
+        self._dates[self._size] = day
+        self._values[self._size] = row
+        self._size += 1
+
+        with metrics.timer("analytics_update"):
+            self._updates += 1
+            if self._updates >= self.window or self.window < ANALYTICS_INCREMENTAL_MIN_WINDOW:
+                self.recompute()
+                return
+            if self._size <= self.window:
+                self._shift([self._size - 1], [1.0], [1.0])
+                self.low = np.fmin(self.low, self._cross(row))
+                self.high = np.fmax(self.high, self._cross(row))
+            else:
+                # Выпавшая дата уносит свой курс (ее изменение в окно не входило),
+                # новая первая дата - свое изменение к выпавшей
+                leaving = self._size - 1 - self.window
+                self._shift([self._size - 1, leaving, leaving + 1], [1.0, -1.0, 0.0], [1.0, 0.0, -1.0])
+                self._update_extremes(self._cross(self._values[leaving]), self._cross(row))
+
+    def _shift(self, positions, value_signs, return_signs):
+        """
+        Добавляет (1) или вычитает (-1) вклад строк positions в оконные суммы: курса (value_signs)
+        и его изменения к предыдущей дате (return_signs). Все строки учитываются одним умножением матриц.
+        """
+        positions = np.asarray(positions)
+        rows = self._values[positions]
+        before = np.where((positions > 0)[:, np.newaxis], self._values[positions - 1], np.nan)
+        inverse, values, valid, returns, returns_valid = self._parts(rows, before)
+        value_signs = np.asarray(value_signs)[:, np.newaxis]
+        return_signs = np.asarray(return_signs)[:, np.newaxis]
+        self._sum += (inverse * value_signs).T @ values
+        self._count += (valid * value_signs).T @ valid
+        signed_valid = returns_valid * return_signs
+        self._returns_sum += signed_valid.T @ returns
+        self._squares_sum += signed_valid.T @ (returns * returns)
+        self._products_sum += (returns * return_signs).T @ returns
+        self._returns_count += signed_valid.T @ returns_valid
+
+    def _update_extremes(self, leaving, arriving):
+        """
+        Сдвигает минимумы и максимумы окна; заново считаются только пары, чей экстремум выпал.
+        """
+        for name, reduce, better in (("low", np.fmin, np.less_equal), ("high", np.fmax, np.greater_equal)):
+            current = getattr(self, name)
+            stale = better(leaving, current) & ~better(arriving, leaving)
+            updated = reduce(current, arriving)
+            rows, columns = np.nonzero(stale)
+            if len(rows):
+                window = self._values[self._size - self.window:self._size]
+                updated[rows, columns] = reduce.reduce(window[:, columns] / window[:, rows], axis=0)
+            setattr(self, name, updated)
+
+    def mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self._count > 0.5, self._sum / self._count, np.nan)
+
+    def volatility(self):
+        # Изменение пары - это изменение курса j минус изменение курса i за те же дни
+        n = self._returns_count
+        s1 = self._returns_sum - self._returns_sum.T
+        s2 = self._squares_sum + self._squares_sum.T - 2 * self._products_sum
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = np.maximum(s2 - s1 * s1 / n, 0.0) / (n - 1)
+            return np.where(n > 1.5, np.sqrt(variance), np.nan)
+
+    def change(self):
+        if self._size < self.window:
+            return np.full((len(self.codes), len(self.codes)), np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._cross(self._values[self._size - 1]) / self._cross(self._values[self._size - self.window]) - 1
+
+    def summary(self, from_currency, to_currency):
+        """
+        Показатели последнего окна для одной пары.
+        """
+        for currency in (from_currency, to_currency):
+            if currency not in self.index:
+                raise ValueError(f"Валюта {currency} не найдена в списке.")
+        i, j = self.index[from_currency], self.index[to_currency]
+        return {"mean": float(self.mean()[i, j]), "volatility": float(self.volatility()[i, j]),
+                "low": float(self.low[i, j]), "high": float(self.high[i, j]),
+                "change": float(self.change()[i, j])}
+
+    def pair_series(self, from_currency, to_currency):
+        """
+        Кросс-курс пары по всей истории и его скользящие показатели (см. rolling_stats).
+        """
+        for currency in (from_currency, to_currency):
+            if currency not in self.index:
+                raise ValueError(f"Валюта {currency} не найдена в списке.")
+        values = self.values
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rates = values[:, self.index[to_currency]] / values[:, self.index[from_currency]]
+        return dict(rolling_stats(rates, self.window), dates=self.dates, rates=rates)
+
+
+def get_cross_rate_matrix(date=None, currencies=None):
+    """
+    Строит матрицу кросс-курсов на дату. По умолчанию - по всем валютам из таблицы ЦБ РФ,
+    для валют интерфейса можно передать CURRENCY_CODES.
+    """
+    try:
+        rates = rate_cache.get(date)
+    except requests.RequestException as e:
+        raise ConnectionError(f"Ошибка подключения к серверу: {e}")
+    except ET.ParseError:
+        raise ValueError("Ошибка обработки данных от сервера. Попробуйте позже.")
+    return CrossRateMatrix(rates, currencies)
+
+
+def parse_batch_date(text):
+    """
+    Дата строки пакетной конвертации: YYYY-MM-DD или DD.MM.YYYY, пустая строка - сегодня.
+    """
+    text = str(text or "").strip()
+    if not text:
+        return date_cls.today()
+    for date_format in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректная дата: {text}")
+
+
+class InvalidBatchRow(dict):
+    """
+    Строка JSONL, которую не удалось прочитать как объект. Хранит исходный текст в поле line,
+    а причину - в reason; convert_batch_chunk возвращает ее как ошибку строки.
+    """
+
+    def __init__(self, line, reason):
+        super().__init__(line=line)
+        self.reason = reason
+
+
+def parse_batch_amount(value):
+    """
+    Сумма строки конвертации: конечное число (NaN и бесконечность не принимаются).
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise ValueError("не указано поле amount")
+    amount = float(value)
+    if not math.isfinite(amount):
+        raise ValueError(f"Некорректная сумма: {value}")
+    return amount
+
+
+def parse_batch_currency(value, field):
+    """
+    Код валюты из поля field: непустая строка, приводится к верхнему регистру.
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise ValueError(f"не указано поле {field}")
+    if not isinstance(value, str):
+        raise ValueError(f"поле {field} должно быть строкой")
+    return value.strip().upper()
+
+
+def read_batch_rows(file, file_format):
+    """
+    Построчно читает строки для конвертации из CSV (с заголовком) или JSONL.
+    Некорректные строки JSONL возвращаются как InvalidBatchRow, чтобы не прерывать обработку файла.
+    """
+    if file_format == "csv":
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield InvalidBatchRow(line, f"некорректный JSON: {e}")
+                continue
+            yield row if isinstance(row, dict) else InvalidBatchRow(line, "ожидается объект JSON")
+
+
+def convert_batch_chunk(rows):
+    """
+    Конвертирует пачку строк: строки группируются по дате, и каждая группа считается
+    одним векторным вызовом по матрице кросс-курсов этой даты.
+    Возвращает массив результатов (NaN для ошибочных строк) и список ошибок по строкам.
+    """
+    count = len(rows)
+    amounts = np.full(count, np.nan)
+    days = np.empty(count, dtype=object)
+    from_codes, to_codes = [""] * count, [""] * count
+    errors = [None] * count
+
+    parsed_dates = {}  # Одинаковые строки дат разбираются один раз
+    for i, row in enumerate(rows):
+        if isinstance(row, InvalidBatchRow):
+            errors[i] = f"Некорректная строка: {row.reason}"
+            continue
+        try:
+            amounts[i] = parse_batch_amount(row.get("amount"))
+            from_codes[i] = parse_batch_currency(row.get("from_currency"), "from_currency")
+            to_codes[i] = parse_batch_currency(row.get("to_currency"), "to_currency")
+            date_text = row.get("date")
+            if date_text not in parsed_dates:
+                parsed_dates[date_text] = parse_batch_date(date_text)
+            days[i] = parsed_dates[date_text]
+        except (TypeError, ValueError) as e:
+            errors[i] = f"Некорректная строка: {e}"
+
+    from_codes, to_codes = np.array(from_codes), np.array(to_codes)
+    results = np.full(count, np.nan)
+    valid = np.array([error is None for error in errors], dtype=bool)
+    if not valid.any():
+        return results, errors
+
+    # Все таблицы пачки загружаются заранее и параллельно
+    unique_days = sorted(set(days[valid]))
+    fetch_rates_many(unique_days)
+
+    day_keys = np.array([day.toordinal() if day is not None else -1 for day in days])
+    for day in unique_days:
+        group = np.flatnonzero(valid & (day_keys == day.toordinal()))
+        try:
+            matrix = get_cross_rate_matrix(day)
+        except Exception as e:
+            for i in group:
+                errors[i] = f"Не удалось получить курсы на {day.strftime('%d.%m.%Y')}: {e}"
+            continue
+
+        known = np.isin(from_codes[group], matrix.codes) & np.isin(to_codes[group], matrix.codes)
+        for i in group[~known]:
+            errors[i] = f"Валюта {from_codes[i]} или {to_codes[i]} не найдена в списке."
+        group = group[known]
+        results[group] = matrix.convert(amounts[group], from_codes[group], to_codes[group])
+        for i in group[~np.isfinite(results[group])]:
+            errors[i] = f"Сумма {amounts[i]} вне допустимого диапазона."
+    return results, errors
+
+
+def convert_file(input_path, output_path, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Потоковая пакетная конвертация CSV/JSONL файла со столбцами amount, from_currency, to_currency, date.
+    Файл читается пачками по chunk_size строк, результаты дописываются в выходной файл сразу,
+    поэтому память не зависит от размера файла. Формат определяется по расширению (.csv или .jsonl).
+    Возвращает количество обработанных строк и ошибок.
+    """
+    input_format = "csv" if input_path.lower().endswith(".csv") else "jsonl"
+    output_format = "csv" if output_path.lower().endswith(".csv") else "jsonl"
+    total = failed = 0
+
+    with open(input_path, "r", encoding="utf-8", newline="") as source, \
+            open(output_path, "w", encoding="utf-8", newline="") as target:
+        writer = None
+        if output_format == "csv":
+            writer = csv.writer(target)
+            writer.writerow(BATCH_FIELDS + ["result", "error"])
+
+        rows_iter = read_batch_rows(source, input_format)
+        while True:
+            rows = list(itertools.islice(rows_iter, chunk_size))
+            if not rows:
+                break
+            results, errors = convert_batch_chunk(rows)
+
+            for row, result, error in zip(rows, results.tolist(), errors):
+                result = None if error else result
+                if writer:
+                    writer.writerow([row.get(field, "") for field in BATCH_FIELDS] +
+                                    ["" if result is None else repr(result), error or ""])
+                else:
+                    target.write(json.dumps({**row, "result": result, "error": error}, ensure_ascii=False) + "\n")
+
+            total += len(rows)
+            failed += sum(error is not None for error in errors)
+            logging.info(f"Обработано строк: {total}, ошибок: {failed}")
+
+    return {"rows": total, "errors": failed}
+
+
+def _parse_backfill_shard(pages):
+    """
+    Разбирает таблицы одной части загрузки истории; выполняется в процессе пула.
+    pages - список (запрошенная дата, байты ответа). Строки матрицы - даты публикации из ответов,
+    повтор одной таблицы (запрос на выходной день) и ответы без курсов пропускаются.
+    Возвращает даты (datetime64[D]), коды валют и матрицу единиц валюты за 1 рубль.
+    """
+    rows = {}
+    for day, content in pages:
+        rates = parse_cbr_rates(content)
+        if len(rates) > 1:  # Только рубль - таблицы на эту дату нет
+            rows.setdefault(rates.date or day, rates.as_dict())
+    codes = sorted(set().union(*rows.values()))
+    column = {code: i for i, code in enumerate(codes)}
+    days = sorted(rows)
+    values = np.full((len(days), len(codes)), np.nan)
+    for i, day in enumerate(days):
+        values[i, [column[code] for code in rows[day]]] = list(rows[day].values())
+    return np.array(days, dtype="datetime64[D]"), codes, values
+
+
+class Backfill:
+    """
+    Загрузка истории курсов за много лет в один файл снимка (формат RateSnapshot, отображается в память).
+    Период делится на части по shard_days календарных дней. Части скачиваются параллельно в workers
+    потоков, XML разбирается в пуле из parse_workers процессов (0 - в потоках загрузки). Каждая готовая
+    часть сразу сохраняется в каталог контрольных точек <output>.parts, поэтому повторный запуск
+    продолжает прерванную загрузку. Когда готовы все части, они сливаются в файл output, а каталог удаляется.
+    Если календарь публикаций удается получить одним запросом динамики, выходные дни не запрашиваются.
+    """
+
+    def __init__(self, output, start=BACKFILL_START, end=None, workers=FETCH_WORKERS, parse_workers=None,
+                 shard_days=BACKFILL_SHARD_DAYS):
+        self.output = output
+        self.parts_dir = f"{output}.parts"
+        self.start = as_date(start)
+        self.end = as_date(end)
+        self.workers = workers
+        self.parse_workers = (os.cpu_count() or 1) if parse_workers is None else parse_workers
+        self.shard_days = shard_days
+        if self.start > self.end:
+            raise ValueError("Начало периода позже его конца.")
+
+    def shards(self):
+        """
+        Части периода: список пар (первый день, последний день).
+        """
+        shards = []
+        first = self.start
+        while first <= self.end:
+            last = min(first + timedelta(days=self.shard_days - 1), self.end)
+            shards.append((first, last))
+            first = last + timedelta(days=1)
+        return shards
+
+    def part_path(self, shard):
+        return os.path.join(self.parts_dir, f"{shard[0].isoformat()}_{shard[1].isoformat()}.npz")
+
+    def publication_days(self):
+        """
+        Даты публикации за период по динамике CALENDAR_CURRENCY; пустое множество, если календарь недоступен.
+        """
+        try:
+            return set(fetch_cbr_dynamic(CALENDAR_CURRENCY, self.start, self.end))
+        except (requests.RequestException, ET.ParseError, ValueError) as e:
+            logging.warning(f"Календарь публикаций недоступен ({e}), запрашиваются все дни периода.")
+            return set()
+
+    def _download(self, shard, published, known_until):
+        """
+        Скачивает ответы на даты части без разбора. Пропускаются только дни до known_until,
+        в которые, по календарю, таблица не публиковалась.
+        """
+        first, last = shard
+        pages = []
+        for offset in range((last - first).days + 1):
+            day = first + timedelta(days=offset)
+            if day < known_until and day not in published:
+                continue
+            response = cbr_get(f"{CBR_DAILY_URL}?date_req={day.strftime('%d/%m/%Y')}")
+            pages.append((day, response.content))
+        return time.time(), pages
+
+    def _save_part(self, shard, fetched_at, parsed):
+        days, codes, values = parsed
+        temp_path = self.part_path(shard) + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, days=days.astype("<i8"), codes=np.array(codes, dtype=str), values=values,
+                     fetched_at=np.full(len(days), fetched_at))
+        os.replace(temp_path, self.part_path(shard))
+
+    def run(self):
+        """
+        Загружает недостающие части и, если все готовы, собирает файл.
+        Возвращает статистику: частей всего, готовых с прошлого запуска, неудачных, запросов и строк в файле.
+        """
+        shards = self.shards()
+        os.makedirs(self.parts_dir, exist_ok=True)
+        pending = [shard for shard in shards if not os.path.exists(self.part_path(shard))]
+        stats = {"shards": len(shards), "resumed": len(shards) - len(pending), "failed": 0, "requests": 0,
+                 "rows": None}
+        published = self.publication_days() if pending else set()
+        known_until = max(published, default=self.start)
+
+        downloads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cbr-backfill")
+        # spawn, а не fork: в процессе уже работают потоки загрузки и HTTP-клиента
+        parsers = ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context("spawn")) \
+            if self.parse_workers else None
+        try:
+            futures = {downloads.submit(self._download, shard, published, known_until): (shard, None)
+                       for shard in pending}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard, fetched_at = futures.pop(future)
+                    try:
+                        result = future.result()
+                        if fetched_at is None:  # Загрузка части завершена, дальше разбор
+                            fetched_at, pages = result
+                            stats["requests"] += len(pages)
+                            if parsers is not None:
+                                futures[parsers.submit(_parse_backfill_shard, pages)] = (shard, fetched_at)
+                                continue
+                            result = _parse_backfill_shard(pages)
+                        self._save_part(shard, fetched_at, result)
+                        logging.info(f"Загружены курсы за {shard[0]} - {shard[1]}")
+                    except (requests.RequestException, ET.ParseError, ValueError, OSError) as e:
+                        stats["failed"] += 1
+                        logging.error(f"Курсы за {shard[0]} - {shard[1]} не загружены: {e}")
+        finally:
+            downloads.shutdown(wait=False, cancel_futures=True)
+            if parsers is not None:
+                parsers.shutdown(cancel_futures=True)
+
+        if not stats["failed"]:
+            stats["rows"] = self.merge(shards)
+        return stats
+
+    def merge(self, shards):
+        """
+        Сливает части в файл снимка: общие коды валют, даты по возрастанию без повторов.
+        Возвращает число строк.
+        """
+        parts = []
+        for shard in shards:
+            with np.load(self.part_path(shard)) as part:
+                parts.append((part["days"], part["fetched_at"], part["codes"].tolist(), part["values"]))
+        codes = sorted(set().union(*(part[2] for part in parts)))
+        column = {code: i for i, code in enumerate(codes)}
+        days = np.concatenate([part[0] for part in parts])
+        fetched_at = np.concatenate([part[1] for part in parts])
+        values = np.full((len(days), len(codes)), np.nan)
+        row = 0
+        for _, _, part_codes, part_values in parts:
+            values[row:row + len(part_values), [column[code] for code in part_codes]] = part_values
+            row += len(part_values)
+
+        # Запрос на первый день части мог вернуть таблицу, уже попавшую в предыдущую часть
+        days, unique = np.unique(days, return_index=True)
+        RateSnapshot.write(self.output, days.astype("datetime64[D]"), fetched_at[unique], codes, values[unique])
+        shutil.rmtree(self.parts_dir)
+        logging.info(f"История курсов записана в {self.output}: {len(days)} таблиц, {len(codes)} валют.")
+        return len(days)
+
+
+class ConversionService:
+    """
+    HTTP-сервис конвертации на asyncio для внутренних инструментов. Использует общий rate_cache,
+    а одновременные запросы на одну и ту же дату объединяются в одну загрузку таблицы.
+
+    GET  /convert?amount=100&from=USD&to=EUR&date=2024-01-31
+    POST /batch    {"rows": [{"amount": ..., "from_currency": ..., "to_currency": ..., "date": ...}]}
+    GET  /history?from=USD&to=EUR&start=2024-01-01&end=2024-12-31
+    """
+
+    def __init__(self):
+        self._pending = {}  # дата -> Future загрузки таблицы
+        self.upstream_loads = 0
+        self.coalesced = 0
+
+    async def get_rates(self, day):
+        """
+        Таблица курсов на дату. Пока таблица загружается, остальные запросы ждут ту же загрузку.
+        """
+        rates = rate_cache.peek(day)
+        if rates is not None:
+            return rates
+
+        future = self._pending.get(day)
+        if future is None:
+            self.upstream_loads += 1
+            future = asyncio.get_running_loop().run_in_executor(None, rate_cache.get, day)
+            self._pending[day] = future
+            future.add_done_callback(lambda _: self._pending.pop(day, None))
+        else:
+            self.coalesced += 1
+        return await future
+
+    async def handle_convert(self, query):
+        amount = parse_batch_amount(query.get("amount"))
+        from_currency = parse_batch_currency(query.get("from"), "from")
+        to_currency = parse_batch_currency(query.get("to"), "to")
+        day = parse_batch_date(query.get("date"))
+        rates = await self.get_rates(day)
+        if from_currency not in rates or to_currency not in rates:
+            raise ValueError(f"Валюта {from_currency} или {to_currency} не найдена в списке.")
+        rate = rates[to_currency] / rates[from_currency]
+        if not math.isfinite(amount * rate):
+            raise ValueError(f"Сумма {amount} вне допустимого диапазона.")
+        return {"amount": amount, "from_currency": from_currency, "to_currency": to_currency,
+                "date": day.isoformat(), "rate": rate, "result": amount * rate}
+
+    async def handle_batch(self, body):
+        payload = json.loads(body or b"{}")
+        rows = payload["rows"] if isinstance(payload, dict) else payload
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("rows должен быть списком объектов")
+        # Таблицы всех дат загружаем заранее с объединением запросов, дальше расчет идет по памяти
+        days = set()
+        for row in rows:
+            try:
+                days.add(parse_batch_date(row.get("date")))
+            except ValueError:
+                pass  # Ошибку такой строки вернет convert_batch_chunk
+        await asyncio.gather(*(self.get_rates(day) for day in days))
+        results, errors = await asyncio.get_running_loop().run_in_executor(None, convert_batch_chunk, rows)
+        return {"results": [None if error else result for result, error in zip(results.tolist(), errors)],
+                "errors": errors}
+
+    async def handle_history(self, query):
+        from_currency = parse_batch_currency(query.get("from"), "from")
+        to_currency = parse_batch_currency(query.get("to"), "to")
+        start, end = parse_batch_date(query["start"]), parse_batch_date(query.get("end"))
+        dates, rates = await asyncio.get_running_loop().run_in_executor(
+            None, get_cbr_history, from_currency, to_currency, start, end)
+        return {"from_currency": from_currency, "to_currency": to_currency,
+                "dates": [str(day) for day in dates],
+                "rates": [None if np.isnan(rate) else rate for rate in rates.tolist()]}
+
+    async def dispatch(self, method, target, body):
+        """
+        Выбирает обработчик по пути запроса и возвращает (код ответа, JSON-данные).
+        """
+        url = urlsplit(target)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if method == "GET" and url.path == "/convert":
+                return HTTPStatus.OK, await self.handle_convert(query)
+            if method == "POST" and url.path == "/batch":
+                return HTTPStatus.OK, await self.handle_batch(body)
+            if method == "GET" and url.path == "/history":
+                return HTTPStatus.OK, await self.handle_history(query)
+            if method == "GET" and url.path == "/metrics":
+                return HTTPStatus.OK, metrics.to_prometheus()
+            if method == "GET" and url.path == "/stats":
+                return HTTPStatus.OK, {"http": http_fetcher.stats(), "cache": rate_cache.stats(),
+                                       "providers": rate_providers.stats()}
+            return HTTPStatus.NOT_FOUND, {"error": f"Неизвестный адрес: {method} {url.path}"}
+        except (KeyError, TypeError, ValueError) as e:
+            return HTTPStatus.BAD_REQUEST, {"error": f"Некорректный запрос: {e}"}
+        except (requests.RequestException, ConnectionError) as e:
+            return HTTPStatus.BAD_GATEWAY, {"error": f"Ошибка подключения к серверу: {e}"}
+        except Exception as e:
+            logging.error(f"Ошибка обработки запроса {target}: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"Произошла ошибка: {e}"}
 
+    async def handle_connection(self, reader, writer):
+        """
+        Минимальный HTTP/1.1 с поддержкой keep-alive.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+
+                status, payload = await self.dispatch(method, target, body)
+                if isinstance(payload, str):  # Метрики отдаются текстом в формате Prometheus
+                    data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                             f"Content-Type: {content_type}; charset=utf-8\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # Клиент закрыл соединение или прислал некорректный запрос
+        finally:
+            writer.close()
+
+    async def start(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def serve_forever(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        server = await self.start(host, port)
+        logging.info(f"Сервис конвертации запущен на http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
 
-def save_conversion(conversion_data):
-    """Сохраняет данные конвертации в файл."""
-    with open(SAVE_FILE, "w", encoding="utf-8") as f:
-        json.dump(conversion_data, f, indent=4, ensure_ascii=False)
 
+# Проверка доступности API и интернета
+def check_api_status():
+    """
+    Проверяет доступность API ЦБ РФ и интернета.
+    Возвращает статус и цвет для отображения в приложении.
+    """
+    # Шаг 1: Легкий HEAD-запрос к API ЦБ РФ, без скачивания всей таблицы курсов
+    try:
+        response = http_fetcher.head(CBR_DAILY_URL)
+        if response.ok:
+            return "API доступен", "green"
+        # Сервер ответил, но с ошибкой
+        return f"API вернул ошибку с кодом: {response.status_code}", "red"
+    except requests.RequestException as e:
+        error = e
 
-def load_conversion():
-    """Загружает данные последней конверсии из файла."""
-    if os.path.exists(SAVE_FILE):
-        with open(SAVE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return None
+    # Шаг 2: API не ответил - проверяем, есть ли интернет вообще
+    if not check_internet_connection():
+        return "Нет подключения к интернету", "red"
+    return f"Ошибка в сети: {error}", "orange"
 
 
-def check_internet_connection():
+class ApiHealthMonitor:
     """
-    Проверяет подключение к интернету через несколько популярных веб-сайтов.
-    Использует несколько этапов подключения для повышения надежности.
+    Кэшированное состояние API ЦБ РФ. Фоновый поток периодически вызывает check_api_status,
+    при ошибках интервал проверки растет (backoff). Кроме того, монитор учитывает исход
+    обычных запросов курсов, поэтому status() отвечает мгновенно и без обращения к сети.
     """
-    # Список сайтов для проверки
-    test_sites = [
-        ("www.google.com", 80),  # HTTP
-        ("www.google.com", 443),  # HTTPS
-        ("www.yandex.ru", 80),
-        ("www.microsoft.com", 443)
-    ]
 
-    for site, port in test_sites:
+    def __init__(self, probe=check_api_status, ttl=HEALTH_TTL, interval=HEALTH_PROBE_INTERVAL,
+                 retry_interval=HEALTH_RETRY_INTERVAL, max_backoff=HEALTH_MAX_BACKOFF):
+        self.probe = probe
+        self.ttl = ttl
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.max_backoff = max_backoff
+        self._status = ("Проверка подключения...", "gray")
+        self._updated_at = 0.0
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._recovery_listeners = []
+
+    def status(self):
+        """
+        Последний известный статус (текст, цвет). Если он устарел, просит фоновый поток проверить API.
+        """
+        with self._lock:
+            if time.time() - self._updated_at > self.ttl:
+                self._wake.set()
+            return self._status
+
+    def is_available(self):
+        return self.status()[1] != "red"
+
+    def add_recovery_listener(self, callback):
+        """
+        callback() вызывается в отдельном потоке, когда API снова становится доступен.
+        """
+        self._recovery_listeners.append(callback)
+
+    def _set_status(self, status):
+        with self._lock:
+            recovered = status[1] == "green" and self._status[1] != "green"
+            self._status = status
+            self._updated_at = time.time()
+            self._failures = 0 if status[1] == "green" else self._failures + 1
+        if recovered:
+            for callback in self._recovery_listeners:
+                threading.Thread(target=callback, name="api-recovery", daemon=True).start()
+
+    def report_success(self):
+        """
+        Запрос к ЦБ РФ завершился успешно.
+        """
+        self._set_status(("API доступен", "green"))
+
+    def report_failure(self, error):
+        """
+        Запрос к ЦБ РФ завершился ошибкой: статус меняется сразу, а точную причину выяснит фоновая проверка.
+        """
+        self._set_status((f"Ошибка в сети: {error}", "orange"))
+        self._wake.set()
+
+    def check_now(self):
+        """
+        Выполняет проверку в текущем потоке и сохраняет результат.
+        """
         try:
-            start_time = time.time()  # Засекаем время подключения
-            # Пробуем создать сокет-соединение
-            logging.info(f"Попытка подключения к {site} через порт {port}...")
+            status = self.probe()
+        except Exception as e:
+            status = (f"Неизвестная ошибка: {e}", "red")
+        self._set_status(status)
+        return status
 
-            # Если порт HTTPS, создаем защищенное соединение
-            if port == 443:
-                context = ssl.create_default_context()
-                with context.wrap_socket(socket.socket(socket.AF_INET), server_hostname=site) as sock:
-                    sock.settimeout(5)
-                    sock.connect((site, port))
-            else:
-                with socket.create_connection((site, port), timeout=5) as sock:
-                    pass  # Если подключение успешно, выходим из блока
+    def next_delay(self):
+        """
+        Пауза до следующей проверки: обычный интервал или растущий интервал после ошибок.
+        """
+        if not self._failures:
+            return self.interval
+        return min(self.retry_interval * 2 ** (self._failures - 1), self.max_backoff)
 
-            # Вычисление времени подключения
-            elapsed_time = time.time() - start_time
-            logging.info(f"Подключение к {site} успешно выполнено за {elapsed_time:.2f} секунд.")
-            return True  # Если одно соединение успешно, возвращаем True
+    def start(self):
+        """
+        Запускает фоновые проверки (повторный вызов ничего не делает).
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="api-health", daemon=True)
+            self._thread.start()
 
-        except (socket.timeout, socket.error, ssl.SSLError) as e:
-            logging.error(f"Ошибка при подключении к {site} через порт {port}: {e}")
-            continue  # Пробуем следующий сайт
+    def _run(self):
+        while True:
+            self._wake.clear()
+            self.check_now()
+            self._wake.wait(self.next_delay())
 
-    # Если не удалось подключиться ни к одному из сайтов
-    logging.error("Не удалось установить подключение к интернету.")
-    return False
+
+api_health = ApiHealthMonitor()
+api_health.add_recovery_listener(lambda: rate_snapshot.reconcile(rate_cache, rate_store))
 
 
-# Проверка интернет соединения
-if check_internet_connection():
-    print("Интернет подключен.")
-else:
-    print("Нет подключения к интернету.")
+def offline_conversion_rate(from_currency, to_currency, date):
+    """
+    Курс пары без обращения к сети: (курс, дата таблицы из снимка) или None, если курса нет.
+    Сначала ищется таблица на эту дату в памяти и локальной базе (тогда дата таблицы равна None),
+    затем в снимке: если таблицы на саму дату нет, берется последняя более ранняя.
+    """
+    rates = rate_cache.lookup(date)
+    if rates is not None:
+        return table_conversion_rate(rates, from_currency, to_currency), None
+    found = rate_snapshot.nearest(date)
+    if found is None:
+        return None
+    table_day, rates = found
+    rate_snapshot.mark_served(date)
+    return table_conversion_rate(rates, from_currency, to_currency), table_day
+
+
+def fetch_conversion_rate(from_currency, to_currency, date):
+    """
+    Проверяет доступность API и получает курс пары. Выполняется в фоновом потоке.
+    Возвращает (курс, дата таблицы из снимка): вторая часть равна None, если курс актуальный,
+    и дате использованной таблицы, если курс выдан из снимка без сети.
+    """
+    # Без сети курс сразу берется из уже загруженных таблиц или снимка, не дожидаясь таймаутов
+    if not api_health.is_available():
+        offline = offline_conversion_rate(from_currency, to_currency, date)
+        if offline is None:
+            raise ConnectionError("Проблемы с подключением к серверу или API.")
+        return offline
+
+    # Получаем курс валют с учетом выбранной даты
+    try:
+        conversion_rate = get_cbr_exchange_rate(from_currency, to_currency, date)
+    except ConnectionError as e:
+        offline = offline_conversion_rate(from_currency, to_currency, date)
+        if offline is None:
+            raise RuntimeError(f"Не удалось получить курс валют: {e}")
+        return offline
+    except Exception as e:
+        raise RuntimeError(f"Не удалось получить курс валют: {e}")
 
+    if conversion_rate is None:
+        raise RuntimeError("Не удалось получить курс валют.")
+    return conversion_rate, None
 
-# Функция для получения курса валют с сайта ЦБ РФ
-def get_cbr_exchange_rate(from_currency, to_currency, date=None):
+
+class WorkerSignals(QObject):
     """
-    Получает курс валют с сайта Центрального банка России для указанной валюты и даты.
-    В случае ошибки возвращает сообщение об ошибке.
+    Сигналы фоновой задачи. Передают в поток интерфейса саму задачу и результат или ошибку.
     """
-    url = "https://www.cbr.ru/scripts/XML_daily.asp"
-    if date:
-        url += f"?date_req={date.strftime('%d/%m/%Y')}"
+    result = pyqtSignal(object, object)
+    error = pyqtSignal(object, object)
+    finished = pyqtSignal(object)
 
-    try:
-        # Выполнение HTTP-запроса к API ЦБ РФ
-        response = requests.get(url)
-        response.encoding = 'windows-1251'  # Устанавливаем правильную кодировку для обработки кириллицы
 
-        # Разбираем XML-ответ
-        tree = ET.ElementTree(ET.fromstring(response.text))
-        root = tree.getroot()
+class Worker(QRunnable):
+    """
+    Фоновая задача для QThreadPool: выполняет функцию вне потока интерфейса.
+    Отмененная задача дорабатывает до конца, но ее результат игнорируется.
+    Пока задача выполняется, упреждающая загрузка не начинает новых задач.
+    """
 
-        # Словарь для хранения курсов валют, RUB всегда равен 1
-        rates = {"RUB": 1.0}
+    def __init__(self, name, fn, *args, on_result=None, on_error=None, **kwargs):
+        super().__init__()
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_result = on_result
+        self.on_error = on_error
+        self.cancelled = False
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            with prefetcher.foreground():
+                result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit(self, e)
+        else:
+            self.signals.result.emit(self, result)
+        finally:
+            self.signals.finished.emit(self)
 
-        # Процесс обработки валют из XML
-        for valute in root.findall("Valute"):
-            char_code = valute.find("CharCode").text
-            value = valute.find("Value").text
-            nominal = int(valute.find("Nominal").text)
 
-            # Преобразование значений с учетом разделителя
-            rates[char_code] = nominal / float(value.replace(',', '.'))
+class FlagIcons:
+    """
+    Общий для процесса кэш иконок флагов. QIcon с именем файла декодирует картинку только
+    при первой отрисовке, поэтому флаги валют, которые не видны в списке, не загружаются вовсе.
+    """
 
-        # Проверка наличия требуемых валют в словаре
-        if from_currency not in rates or to_currency not in rates:
-            raise ValueError(f"Валюта {from_currency} или {to_currency} не найдена в списке.")
+    def __init__(self):
+        self._icons = {}
+        self._empty = None
+
+    def icon(self, code):
+        icon = self._icons.get(code)
+        if icon is None:
+            path = CURRENCY_FLAG_FILES.get(code)
+            if path is None:
+                if self._empty is None:
+                    self._empty = QIcon()
+                icon = self._empty
+            else:
+                icon = QIcon(path)
+            self._icons[code] = icon
+        return icon
 
-        # Расчет курса конверсии
-        conversion_rate = rates[to_currency] * rates["RUB"] / rates[from_currency]
-        return conversion_rate
 
-    except requests.RequestException as e:
-        raise ConnectionError(f"Ошибка подключения к серверу: {e}")
-    except ET.ParseError:
-        raise ValueError("Ошибка обработки данных от сервера. Попробуйте позже.")
-    except Exception as e:
-        raise RuntimeError(f"Произошла ошибка: {e}")
+flag_icons = FlagIcons()
 
 
-# Проверка доступности API и интернета
-def check_api_status():
+class CurrencyListModel(QAbstractListModel):
     """
-    Проверяет доступность интернета и API ЦБ РФ.
-    Возвращает статус и цвет для отображения в приложении.
+    Одна модель списка валют для обоих выпадающих списков. Строки только добавляются
+    (при пополнении каталога), поэтому выбранные в списках валюты не сбрасываются.
     """
-    # Шаг 1: Проверка наличия подключения к интернету
-    internet_connected = check_internet_connection()
 
-    if not internet_connected:
-        # Если интернета нет, сразу возвращаем статус "Нет подключения"
-        return "Нет подключения к интернету", "red"
-
-    # Шаг 2: Выполнение запроса к API ЦБ РФ для проверки его доступности
-    response = None
-    try:
-        response = requests.get("https://www.cbr.ru/scripts/XML_daily.asp")
-        # Шаг 3: Проверка статуса ответа от сервера
-        if response.status_code != 200:
-            # Если сервер вернул неожиданный статус
-            return f"API недоступен, код ответа: {response.status_code}", "red"
+    def __init__(self, catalogue, parent=None):
+        super().__init__(parent)
+        self.catalogue = catalogue
+        self.codes = catalogue.codes()
+        self.version = catalogue.version
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.codes)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        code = self.codes[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return code
+        if role == Qt.ItemDataRole.DecorationRole:
+            return flag_icons.icon(code)
+        if role == Qt.ItemDataRole.ToolTipRole:
+            info = self.catalogue.get(code)
+            return info.name if info else None
+        return None
+
+    def sync(self):
+        """
+        Добавляет валюты, появившиеся в каталоге. Без изменений каталога ничего не делает.
+        """
+        if self.version == self.catalogue.version:
+            return
+        self.version = self.catalogue.version
+        known = set(self.codes)
+        added = [code for code in self.catalogue.codes() if code not in known]
+        if added:
+            self.beginInsertRows(QModelIndex(), len(self.codes), len(self.codes) + len(added) - 1)
+            self.codes.extend(added)
+            self.endInsertRows()
+
+
+class RateChart(QWidget):
+    """
+    Встроенный график истории курса на QPainter.
+    Хранит весь загруженный ряд, а рисует только видимое окно: если точек больше, чем пикселей,
+    для каждого столбца пикселей остаются минимум и максимум. Поверх курса можно показать
+    второй ряд на тех же датах (скользящее среднее). Колесо мыши меняет масштаб,
+    перетаскивание сдвигает окно, двойной щелчок показывает весь ряд. Перья и шрифты создаются один раз.
+    """
 
-        # Шаг 4: Дальнейшая обработка ответа сервера
-        if response.ok:
-            # Если сервер вернул успешный статус 200
-            return "API доступен", "green"
-        else:
-            # В случае других проблем с API
-            return "API недоступен", "yellow"
-    except requests.RequestException as e:
-        # Шаг 5: Обработка ошибки запроса, если проблема с сетью или сервером
-        return f"Ошибка в сети: {e}", "orange"
-    except Exception as e:
-        # Шаг 6: Общая ошибка, если что-то пошло не так в процессе выполнения запроса
-        return f"Неизвестная ошибка: {e}", "red"
-    finally:
-        # Шаг 7: Проверка состояния ответа, если он был получен
-        if response:
-            if response.status_code == 200:
-                # Дополнительная проверка успешности, если ответ получен
-                return "API доступен", "green"
+    MARGINS = (70, 40, 20, 50)  # Отступы области графика: слева, сверху, справа, снизу
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(300)
+        self.setMouseTracking(False)
+        self.days = np.empty(0)  # Даты как число дней от 1970-01-01
+        self.rates = np.empty(0)
+        self.overlay = np.empty(0)
+        self.title = ""
+        self.view_start = self.view_end = 0.0
+        self._drag = None  # (x курсора, начало окна) при перетаскивании
+
+        self.line_pen = QPen(QColor("blue"), 2)
+        self.dense_line_pen = QPen(QColor("blue"), 1)  # Толстая ломаная из тысяч точек рисуется в сотни раз дольше
+        self.overlay_pen = QPen(QColor("orange"), 1)
+        self.axis_pen = QPen(QColor("#333"), 1)
+        self.grid_pen = QPen(QColor("#ccc"), 1, Qt.PenStyle.DashLine)
+        self.title_font = QFont("Arial", 14)
+        self.label_font = QFont("Arial", 9)
+
+    def set_series(self, dates, rates, title, visible_days=CHART_VISIBLE_DAYS, overlay=None):
+        """
+        Заменяет ряд на графике и показывает последние visible_days дней.
+        overlay - необязательный второй ряд той же длины.
+        """
+        self.days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64).astype(np.float64)
+        self.rates = np.asarray(rates, dtype=np.float64)
+        self.overlay = np.empty(0) if overlay is None else np.asarray(overlay, dtype=np.float64)
+        self.title = title
+        if len(self.days):
+            self.set_view(self.days[-1] - visible_days + 1, self.days[-1])
+        self.update()
+
+    def warm_up(self):
+        """
+        Рисует пробный ряд во внеэкранное изображение. Первая отрисовка в процессе в несколько раз
+        дольше следующих (PyQt создает перечисления при первом обращении, Qt заполняет кэш глифов),
+        поэтому ее выполняют заранее, а не в момент показа загруженной истории.
+        """
+        probe = RateChart()
+        probe.resize(self.width(), self.minimumHeight())
+        days = np.arange(CHART_VISIBLE_DAYS) + np.datetime64(date_cls.today(), "D") - CHART_VISIBLE_DAYS + 1
+        rates = np.linspace(1.0, 2.0, CHART_VISIBLE_DAYS)
+        probe.set_series(days, rates, self.title or " ", overlay=rates)
+        probe.grab()
+        probe.deleteLater()
+
+    def set_view(self, start, end):
+        """
+        Устанавливает видимое окно, не выходя за пределы загруженного ряда.
+        """
+        if not len(self.days):
+            return
+        first, last = self.days[0], self.days[-1]
+        span = min(max(end - start, CHART_MIN_SPAN_DAYS), max(last - first, CHART_MIN_SPAN_DAYS))
+        start = min(max(start, first), max(last - span, first))
+        self.view_start, self.view_end = start, start + span
+        self.update()
+
+    def plot_rect(self):
+        left, top, right, bottom = self.MARGINS
+        return QRectF(left, top, max(self.width() - left - right, 1), max(self.height() - top - bottom, 1))
+
+    def visible_points(self, columns, series=None):
+        """
+        Точки видимого окна, прореженные до двух (минимум и максимум) на столбец пикселей.
+        series - ряд вместо курса (например, overlay).
+        """
+        lo = max(np.searchsorted(self.days, self.view_start, "left") - 1, 0)
+        hi = np.searchsorted(self.days, self.view_end, "right") + 1
+        days, rates = self.days[lo:hi], (self.rates if series is None else series)[lo:hi]
+        if len(days) <= 2 * columns:
+            return days, rates
+
+        column = ((days - self.view_start) * (columns / (self.view_end - self.view_start))).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+        low = np.fmin.reduceat(rates, starts)  # fmin/fmax пропускают NaN, пустой столбец остается NaN
+        high = np.fmax.reduceat(rates, starts)
+        return np.repeat(days[starts], 2), np.column_stack((low, high)).ravel()
+
+    def paintEvent(self, event):
+        with metrics.timer("render"):
+            painter = QPainter(self)
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            painter.fillRect(self.rect(), QColor("white"))
+            rect = self.plot_rect()
+
+            painter.setFont(self.title_font)
+            painter.setPen(self.axis_pen)
+            painter.drawText(QRectF(0, 0, self.width(), rect.top()), Qt.AlignmentFlag.AlignCenter, self.title)
+
+            days, rates = self.visible_points(int(rect.width()))
+            finite = np.isfinite(rates)
+            if not finite.any():
+                painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, "Нет данных для отображения")
+                painter.end()
+                return
+
+            low, high = rates[finite].min(), rates[finite].max()
+            padding = (high - low) * 0.05 or abs(high) * 0.01 or 1.0
+            low, high = low - padding, high + padding
+            scale_x = rect.width() / (self.view_end - self.view_start)
+            scale_y = rect.height() / (high - low)
+            xs = rect.left() + (days - self.view_start) * scale_x
+            ys = rect.bottom() - (rates - low) * scale_y
+
+            self.draw_axes(painter, rect, low, high)
+            painter.setClipRect(rect)
+            painter.setPen(self.line_pen if len(days) <= rect.width() / 8 else self.dense_line_pen)
+            self.draw_line(painter, xs, ys, finite)
+            if len(self.overlay) == len(self.days):
+                overlay_days, overlay = self.visible_points(int(rect.width()), self.overlay)
+                painter.setPen(self.overlay_pen)
+                self.draw_line(painter, rect.left() + (overlay_days - self.view_start) * scale_x,
+                               rect.bottom() - (overlay - low) * scale_y, np.isfinite(overlay))
+            painter.setPen(self.line_pen if len(days) <= rect.width() / 8 else self.dense_line_pen)
+            if len(days) <= rect.width() / 8:  # Маркеры точек, пока они не сливаются
+                painter.setBrush(QColor("blue"))
+                for x, y in zip(xs[finite].tolist(), ys[finite].tolist()):
+                    painter.drawEllipse(QPointF(x, y), 3, 3)
+            painter.setClipping(False)
+
+            if not finite.all():
+                painter.setPen(QColor("red"))
+                painter.drawText(rect, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter,
+                                 "Не все данные доступны для отображения")
+            painter.end()
+
+    def draw_line(self, painter, xs, ys, finite):
+        # Пропуски в данных разрывают линию на отдельные участки
+        bounds = np.flatnonzero(np.diff(np.r_[False, finite, False].astype(np.int8)))
+        for begin, end in zip(bounds[::2], bounds[1::2]):
+            points = QPolygonF([QPointF(x, y) for x, y in zip(xs[begin:end].tolist(), ys[begin:end].tolist())])
+            if end - begin > 1:
+                painter.drawPolyline(points)
             else:
-                # Вернуть статус, если код ответа не равен 200
-                return f"API вернул ошибку с кодом: {response.status_code}", "red"
+                painter.drawEllipse(points[0], 3, 3)
+
+    def draw_axes(self, painter, rect, low, high, ticks=5):
+        painter.setFont(self.label_font)
+        for i in range(ticks + 1):
+            value = low + (high - low) * i / ticks
+            y = rect.bottom() - rect.height() * i / ticks
+            painter.setPen(self.grid_pen)
+            painter.drawLine(QPointF(rect.left(), y), QPointF(rect.right(), y))
+            painter.setPen(self.axis_pen)
+            painter.drawText(QRectF(0, y - 10, rect.left() - 6, 20),
+                             Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter, f"{value:.4g}")
+        for i in range(ticks + 1):
+            day = self.view_start + (self.view_end - self.view_start) * i / ticks
+            x = rect.left() + rect.width() * i / ticks
+            painter.setPen(self.grid_pen)
+            painter.drawLine(QPointF(x, rect.top()), QPointF(x, rect.bottom()))
+            painter.setPen(self.axis_pen)
+            label = np.datetime64(int(round(day)), "D").astype(object).strftime("%d.%m.%Y")
+            painter.drawText(QRectF(x - 40, rect.bottom() + 4, 80, 20), Qt.AlignmentFlag.AlignCenter, label)
+        painter.drawRect(rect)
+
+    def zoom(self, factor, anchor=None):
+        """
+        Меняет масштаб в factor раз относительно дня anchor (по умолчанию - центра окна).
+        """
+        if anchor is None:
+            anchor = (self.view_start + self.view_end) / 2
+        self.set_view(anchor - (anchor - self.view_start) * factor, anchor + (self.view_end - anchor) * factor)
+
+    def pan(self, days):
+        self.set_view(self.view_start + days, self.view_end + days)
+
+    def wheelEvent(self, event):
+        rect = self.plot_rect()
+        anchor = self.view_start + (event.position().x() - rect.left()) / rect.width() * (self.view_end - self.view_start)
+        self.zoom(0.8 ** (event.angleDelta().y() / 120), anchor)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self._drag = (event.position().x(), self.view_start)
+
+    def mouseMoveEvent(self, event):
+        if self._drag is not None:
+            x, start = self._drag
+            span = self.view_end - self.view_start
+            start -= (event.position().x() - x) / self.plot_rect().width() * span
+            self.set_view(start, start + span)
+
+    def mouseReleaseEvent(self, event):
+        self._drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        if len(self.days):
+            self.set_view(self.days[0], self.days[-1])
 
 
 # Основное окно приложения
@@ -190,27 +3260,33 @@ class CurrencyConverterApp(QMainWindow):
 
         layout = QVBoxLayout()
 
+        # Фоновые задачи: сеть и разбор XML не должны блокировать интерфейс
+        self.thread_pool = QThreadPool.globalInstance()
+        self.active_workers = {}  # имя задачи -> Worker
+
         # Индикатор API
         self.api_status_label = QLabel()
-        status_text, status_color = check_api_status()
-        self.api_status_label.setText(status_text)
-        self.api_status_label.setStyleSheet(f"""
-            QLabel {{
-                background-color: {status_color};
-                border-radius: 15px;
-                color: white;
-                font-size: 16px;
-                padding: 10px;
-                text-align: center;
-            }}
-        """)
+        self.set_api_status("Проверка подключения...", "gray")
         self.api_status_label.setFixedHeight(50)  # Высота текста статуса
         layout.addWidget(self.api_status_label)
 
+        # Индикатор загрузки, виден пока выполняются фоновые задачи
+        self.busy_indicator = QProgressBar()
+        self.busy_indicator.setRange(0, 0)
+        self.busy_indicator.setTextVisible(False)
+        self.busy_indicator.setFixedHeight(6)
+        # Скрытый индикатор сохраняет место: иначе его показ и скрытие сдвигают и перерисовывают все окно
+        policy = self.busy_indicator.sizePolicy()
+        policy.setRetainSizeWhenHidden(True)
+        self.busy_indicator.setSizePolicy(policy)
+        self.busy_indicator.hide()
+        layout.addWidget(self.busy_indicator)
+
         # Верхний макет для ввода и выбора валют
         top_layout = QHBoxLayout()
 
-        # Левый комбо-бокс с валютами и флагами
+        # Левый комбо-бокс с валютами и флагами; оба списка используют одну модель каталога
+        self.currency_model = CurrencyListModel(currency_catalogue, self)
         self.from_currency_combo = self.create_currency_combo()
         self.from_amount_input = self.create_styled_input_field()
         self.from_amount_input.setPlaceholderText("Введите сумму")
@@ -237,6 +3313,12 @@ class CurrencyConverterApp(QMainWindow):
         # Добавляем верхний макет в основной
         layout.addLayout(top_layout)
 
+        # Предупреждение о том, что курс взят из снимка без сети
+        self.offline_label = QLabel()
+        self.offline_label.setStyleSheet("QLabel { color: #b35900; font-size: 13px; }")
+        self.offline_label.hide()
+        layout.addWidget(self.offline_label)
+
         # Кнопка для запуска конвертации
         self.convert_button = QPushButton("Конвертировать")
         self.convert_button.setStyleSheet(
@@ -265,6 +3347,9 @@ class CurrencyConverterApp(QMainWindow):
         )
         self.plus_button.clicked.connect(self.increase_amount)
         self.minus_button.clicked.connect(self.decrease_amount)
+        for button, key in ((self.plus_button, "+"), (self.minus_button, "-")):
+            button.setShortcut(QKeySequence(key))
+            button.setAutoRepeat(True)  # Удержание кнопки или клавиши повторяет шаг
         change_layout.addWidget(self.minus_button)
         change_layout.addWidget(self.plus_button)
         layout.addLayout(change_layout)
@@ -288,6 +3373,15 @@ class CurrencyConverterApp(QMainWindow):
         date_layout.addWidget(self.date_edit)
         layout.addLayout(date_layout)
 
+        # График истории курса, появляется после первой загрузки
+        self.chart = RateChart()
+        self.chart.hide()
+        layout.addWidget(self.chart)
+        self.chart_stats_label = QLabel("")
+        self.chart_stats_label.setStyleSheet("font-size: 13px; color: #333;")
+        self.chart_stats_label.hide()
+        layout.addWidget(self.chart_stats_label)
+
         # Настройки валюты поумолчанию
         self.from_currency_combo.setCurrentText("USD")
         self.to_currency_combo.setCurrentText("RUB")
@@ -300,6 +3394,127 @@ class CurrencyConverterApp(QMainWindow):
         # Загрузка последней конвертации
         self.load_settings()
 
+        # При смене пары или даты ответы на старые запросы больше не нужны
+        self.from_currency_combo.currentTextChanged.connect(self.cancel_stale_requests)
+        self.to_currency_combo.currentTextChanged.connect(self.cancel_stale_requests)
+        self.date_edit.dateChanged.connect(self.cancel_stale_requests)
+
+        # Живая конвертация: по загруженной таблице результат считается сразу,
+        # недостающая таблица загружается после паузы во вводе
+        self.live_convert_timer = QTimer(self)
+        self.live_convert_timer.setSingleShot(True)
+        self.live_convert_timer.setInterval(LIVE_CONVERT_DELAY_MS)
+        self.live_convert_timer.timeout.connect(self.fetch_live_rates)
+        self.from_amount_input.textChanged.connect(self.live_convert)
+        self.from_currency_combo.currentTextChanged.connect(self.live_convert)
+        self.to_currency_combo.currentTextChanged.connect(self.live_convert)
+        self.date_edit.dateChanged.connect(self.live_convert)
+        self.live_convert()
+
+        # Упреждающая загрузка соседних дат и истории для графика выбранной пары
+        self.date_edit.dateChanged.connect(self.schedule_prefetch)
+        self.from_currency_combo.currentTextChanged.connect(self.schedule_chart_prefetch)
+        self.to_currency_combo.currentTextChanged.connect(self.schedule_chart_prefetch)
+        QTimer.singleShot(0, prefetcher.start)
+        QTimer.singleShot(0, self.schedule_prefetch)
+        QTimer.singleShot(0, self.schedule_chart_prefetch)
+        QTimer.singleShot(CHART_WARM_UP_DELAY_MS, self.chart.warm_up)
+
+        # Проверка интернета и API выполняется монитором в фоне, индикатор читает его кэшированный статус
+        QTimer.singleShot(0, api_health.start)
+        self.api_status_timer = QTimer(self)
+        self.api_status_timer.timeout.connect(self.refresh_api_status)
+        self.api_status_timer.start(1000)
+
+    def set_api_status(self, status_text, status_color):
+        """
+        Обновляет индикатор состояния API.
+        """
+        self.api_status_label.setText(status_text)
+        self.api_status_label.setStyleSheet(f"""
+            QLabel {{
+                background-color: {status_color};
+                border-radius: 15px;
+                color: white;
+                font-size: 16px;
+                padding: 10px;
+                text-align: center;
+            }}
+        """)
+
+    def refresh_api_status(self):
+        """
+        Показывает последний статус из api_health, если он изменился.
+        """
+        self.currency_model.sync()  # Каталог мог пополниться из загруженной ленты
+        status_text, status_color = api_health.status()
+        if status_text != self.api_status_label.text():
+            self.set_api_status(status_text, status_color)
+            # Связь восстановилась: результат из снимка пересчитывается по актуальным курсам
+            if status_color == "green" and self.offline_label.isVisible():
+                self.live_convert()
+
+    def schedule_prefetch(self):
+        """
+        Просит планировщик заранее загрузить даты вокруг выбранной.
+        """
+        prefetcher.prefetch_neighbours(self.date_edit.date().toPyDate())
+
+    def schedule_chart_prefetch(self):
+        """
+        Просит планировщик заранее загрузить историю для графика выбранной пары.
+        """
+        prefetcher.prefetch_chart(self.from_currency_combo.currentText(), self.to_currency_combo.currentText())
+
+    def run_in_background(self, name, fn, *args, on_result=None, on_error=None, **kwargs):
+        """
+        Запускает функцию в пуле потоков. Предыдущая задача с тем же именем отменяется.
+        """
+        self.cancel_worker(name)
+        worker = Worker(name, fn, *args, on_result=on_result, on_error=on_error, **kwargs)
+        worker.signals.result.connect(self._on_worker_result)
+        worker.signals.error.connect(self._on_worker_error)
+        worker.signals.finished.connect(self._on_worker_finished)
+        self.active_workers[name] = worker
+        self.update_busy_state()
+        self.thread_pool.start(worker)
+        return worker
+
+    def cancel_worker(self, name):
+        worker = self.active_workers.pop(name, None)
+        if worker:
+            worker.cancel()
+        self.update_busy_state()
+
+    def cancel_stale_requests(self):
+        """
+        Отменяет конвертацию и построение графика для устаревших пары или даты.
+        """
+        self.cancel_worker("convert")
+        self.cancel_worker("chart")
+
+    def update_busy_state(self):
+        self.busy_indicator.setVisible(bool(self.active_workers))
+        self.convert_button.setEnabled("convert" not in self.active_workers)
+        self.show_chart_button.setEnabled("chart" not in self.active_workers)
+
+    def _on_worker_result(self, worker, result):
+        if not worker.cancelled and worker.on_result:
+            worker.on_result(result)
+
+    def _on_worker_error(self, worker, error):
+        if worker.cancelled:
+            return
+        if worker.on_error:
+            worker.on_error(error)
+        else:
+            logging.error(f"Ошибка фоновой задачи {worker.name}: {error}")
+
+    def _on_worker_finished(self, worker):
+        if self.active_workers.get(worker.name) is worker:
+            del self.active_workers[worker.name]
+            self.update_busy_state()
+
     def load_settings(self):
         """
         Загружает сохраненные валюты и сумму из файла.
@@ -332,36 +3547,22 @@ class CurrencyConverterApp(QMainWindow):
 
     def closeEvent(self, event):
         """
-        Событие при закрытии окна — сохраняем настройки.
+        Событие при закрытии окна — сохраняем настройки и снимок курсов для работы без сети.
         """
         self.save_settings()
+        try:
+            rate_snapshot.save_from(rate_store)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Не удалось сохранить снимок курсов: {e}")
         event.accept()
 
 
     def create_currency_combo(self):
         """
-        Создает комбинированный список с валютами и их флагами.
+        Создает комбинированный список с валютами и их флагами на общей модели каталога.
         """
         combo = QComboBox()
-        currencies = [
-            ("USD", "flags/united-states.png"),
-            ("EUR", "flags/european-union.png"),
-            ("GBP", "flags/united-kingdom.png"),
-            ("JPY", "flags/japan.png"),
-            ("CNY", "flags/china.png"),
-            ("RUB", "flags/russia.png"),
-            ("BRL", "flags/brazil.png"),
-            ("KZT", "flags/kazakhstan.png"),
-            ("PLN", "flags/poland.png"),
-            ("BYN", "flags/belarus.png"),
-            ("CZK", "flags/czech-republic.png"),
-            ("SEK", "flags/sweden.png"),
-            ("RSD", "flags/serbia.png")
-        ]
-        for currency, flag in currencies:
-            pixmap = QPixmap(flag)
-            icon = QIcon(pixmap)
-            combo.addItem(icon, currency)
+        combo.setModel(self.currency_model)
         return combo
 
     def create_styled_input_field(self):
@@ -396,6 +3597,7 @@ class CurrencyConverterApp(QMainWindow):
     def convert_currency(self):
         """
         Выполняет конвертацию валют и выводит результат.
+        Курс загружается в фоне, результат выводит on_conversion_rate.
         """
         try:
             # Шаг 1: Получаем данные из интерфейса
@@ -415,59 +3617,145 @@ class CurrencyConverterApp(QMainWindow):
             if amount <= 0:
                 raise ValueError("Сумма должна быть положительным числом.")
 
-            # Шаг 3: Проверка доступности API перед конвертацией
-            api_status, status_color = check_api_status()
-            if status_color == "red":
-                raise ConnectionError("Проблемы с подключением к серверу или API.")
+            # Шаг 3: Проверка API и получение курса в фоновом потоке
+            self.run_in_background(
+                "convert", fetch_conversion_rate, from_currency, to_currency, self.date_edit.date().toPyDate(),
+                on_result=lambda quote: self.on_conversion_rate(amount, from_currency, to_currency, *quote),
+                on_error=self.on_conversion_error
+            )
 
-            # Шаг 4: Получаем курс валют с учетом выбранной даты
-            conversion_rate = None
-            try:
-                conversion_rate = get_cbr_exchange_rate(from_currency, to_currency, self.date_edit.date().toPyDate())
-            except Exception as e:
-                raise RuntimeError(f"Не удалось получить курс валют: {e}")
+        except ValueError as e:
+            # Шаг 4: Обработка ошибок при некорректных входных данных
+            self.show_error(str(e))
+
+    def on_conversion_rate(self, amount, from_currency, to_currency, conversion_rate, offline_day=None):
+        """
+        Выполняет расчет конвертации по полученному курсу и выводит результат.
+        offline_day - дата таблицы, если курс взят из снимка без сети.
+        """
+        converted_amount = amount * conversion_rate
+
+        # Выводим результат в поле
+        formatted_amount = f"{converted_amount:.2f}"
+        self.to_amount_input.setText(formatted_amount)
+        self.set_offline_notice(offline_day)
+
+        # Дополнительно: Логирование успешного выполнения
+        print(f"Конвертация завершена: {amount} {from_currency} -> {formatted_amount} {to_currency}")
+
+    def live_amount(self):
+        """
+        Сумма из поля ввода или None, если она пустая или некорректная. Ошибки не показываются.
+        """
+        try:
+            amount = float(self.from_amount_input.text())
+        except ValueError:
+            return None
+        return amount if amount > 0 else None
 
-            # Шаг 5: Выполняем расчет конвертации
-            if conversion_rate is None:
-                raise RuntimeError("Не удалось получить курс валют.")
+    def live_convert(self):
+        """
+        Пересчитывает результат при изменении суммы, пары или даты.
+        Если таблица курсов на выбранную дату уже в памяти, расчет идет сразу без обращения к сети,
+        иначе после паузы во вводе таблица загружается в фоне.
+        """
+        if self.refresh_live_result():
+            self.live_convert_timer.stop()
+        else:
+            self.live_convert_timer.start()  # Перезапуск таймера откладывает загрузку до паузы
 
-            converted_amount = amount * conversion_rate
+    def refresh_live_result(self):
+        """
+        Выводит результат по таблице курсов из памяти. Возвращает False, если таблицы там нет.
+        """
+        amount = self.live_amount()
+        if amount is None:
+            self.to_amount_input.clear()
+            return True
 
-            # Шаг 6: Выводим результат в поле
-            formatted_amount = f"{converted_amount:.2f}"
-            self.to_amount_input.setText(formatted_amount)
+        rates = rate_cache.peek(self.date_edit.date().toPyDate())
+        if rates is None:
+            return False
 
-            # Дополнительно: Логирование успешного выполнения
-            print(f"Конвертация завершена: {amount} {from_currency} -> {formatted_amount} {to_currency}")
+        try:
+            conversion_rate = table_conversion_rate(rates, self.from_currency_combo.currentText(),
+                                                    self.to_currency_combo.currentText())
+        except ValueError:
+            self.to_amount_input.clear()
+            return True
+        self.to_amount_input.setText(f"{amount * conversion_rate:.2f}")
+        self.set_offline_notice(None)
+        return True
 
-        except ValueError as e:
-            # Шаг 7: Обработка ошибок при некорректных входных данных
-            self.show_error(str(e))
-        except (ConnectionError, RuntimeError) as e:
-            # Шаг 8: Обработка ошибок сетевых проблем или проблем с API
-            self.show_error(f"Ошибка: {e}")
-        except Exception as e:
-            # Шаг 9: Общая обработка ошибок
-            self.show_error(f"Произошла непредвиденная ошибка: {e}")
+    def fetch_live_rates(self):
+        """
+        Загружает в фоне таблицу курсов для живой конвертации и пересчитывает результат по текущему вводу.
+        """
+        if self.live_amount() is None:
+            return
+        self.run_in_background(
+            "convert", fetch_conversion_rate, self.from_currency_combo.currentText(),
+            self.to_currency_combo.currentText(), self.date_edit.date().toPyDate(),
+            on_result=self.on_live_quote,
+            on_error=lambda error: logging.warning(f"Живая конвертация недоступна: {error}")
+        )
+
+    def set_offline_notice(self, offline_day):
+        """
+        Показывает, что результат посчитан по сохраненному снимку, или скрывает предупреждение.
+        """
+        if offline_day is None:
+            self.offline_label.hide()
+            return
+        created_at = rate_snapshot.created_at
+        saved = datetime.fromtimestamp(created_at).strftime("%d.%m.%Y %H:%M") if created_at else "неизвестно"
+        self.offline_label.setText(f"Нет связи с ЦБ РФ: курс на {offline_day.strftime('%d.%m.%Y')} "
+                                   f"из сохраненных данных (снимок от {saved})")
+        self.offline_label.show()
+
+    def on_live_quote(self, quote):
+        """
+        Результат фоновой загрузки для живой конвертации. Курс из снимка в кэш не попадает,
+        поэтому в этом случае результат считается по самому полученному курсу.
+        """
+        amount = self.live_amount()
+        if not self.refresh_live_result() and amount is not None:
+            conversion_rate, offline_day = quote
+            self.to_amount_input.setText(f"{amount * conversion_rate:.2f}")
+            self.set_offline_notice(offline_day)
+
+    def on_conversion_error(self, error):
+        """
+        Показывает ошибку, возникшую при получении курса.
+        """
+        if isinstance(error, ValueError):
+            # Обработка ошибок при некорректных данных
+            self.show_error(str(error))
+        elif isinstance(error, (ConnectionError, RuntimeError)):
+            # Обработка ошибок сетевых проблем или проблем с API
+            self.show_error(f"Ошибка: {error}")
+        else:
+            # Общая обработка ошибок
+            self.show_error(f"Произошла непредвиденная ошибка: {error}")
 
     def increase_amount(self):
         """
-        Увеличивает сумму на 10 единиц.
+        Увеличивает сумму на AMOUNT_STEP единиц.
         """
         try:
             current_value = float(self.from_amount_input.text())
-            new_value = current_value + 10
+            new_value = current_value + AMOUNT_STEP
             self.from_amount_input.setText(f"{new_value:.2f}")
         except ValueError:
             self.show_error("Введите корректное число.")
 
     def decrease_amount(self):
         """
-        Уменьшает сумму на 10 единиц.
+        Уменьшает сумму на AMOUNT_STEP единиц.
         """
         try:
             current_value = float(self.from_amount_input.text())
-            new_value = current_value - 10
+            new_value = current_value - AMOUNT_STEP
             if new_value < 0:
                 raise ValueError("Сумма не может быть меньше нуля.")
             self.from_amount_input.setText(f"{new_value:.2f}")
@@ -482,9 +3770,9 @@ class CurrencyConverterApp(QMainWindow):
 
     def show_chart(self):
         """
-        Отображает график изменения курса валют за последние 30 дней.
-        Это более современная версия с улучшенной обработкой ошибок,
-        логированием и визуализацией.
+        Отображает встроенный график изменения курса валют.
+        История загружается в фоне сразу за CHART_HISTORY_DAYS дней, поэтому прокрутка
+        и масштабирование графика не обращаются к сети. Сначала видны последние CHART_VISIBLE_DAYS дней.
         """
         try:
             # Шаг 1: Получение выбранных валют
@@ -492,62 +3780,66 @@ class CurrencyConverterApp(QMainWindow):
             to_currency = self.to_currency_combo.currentText()
 
             # Логируем выбранные валюты
-            print(f"Выбраны валюты для графика: {from_currency} -> {to_currency}")
+            logging.info(f"Выбраны валюты для графика: {from_currency} -> {to_currency}")
 
-            # Шаг 2: Определение диапазона дат (30 последних дней)
-            today = datetime.today()
-            dates = [today - timedelta(days=i) for i in range(10)]  # Изменили с 10 на 30 дней
-            print(f"Запрашиваем курсы валют с датами: {', '.join([date.strftime('%d.%m.%Y') for date in dates])}")
+            # Шаг 2: Определение диапазона дат
+            today = datetime.today().date()
+            start = today - timedelta(days=CHART_HISTORY_DAYS - 1)
+            logging.info(f"Запрашиваем курсы валют за период {start.strftime('%d.%m.%Y')} - {today.strftime('%d.%m.%Y')}")
 
-            # Шаг 3: Получение курсов валют для каждой из дат
-            rates = []
-            for date in dates:
-                try:
-                    rate = get_cbr_exchange_rate(from_currency, to_currency, date)
-                    rates.append(rate)
-                    print(f"Курс на {date.strftime('%d.%m.%Y')}: {rate}")
-                except Exception as e:
-                    print(f"Ошибка получения курса на {date.strftime('%d.%m.%Y')}: {e}")
-                    rates.append(None)  # Если курс не получен, добавляем None
+            # Шаг 3: Получение истории курса за весь период в фоновом потоке
+            self.run_in_background(
+                "chart", get_chart_history, from_currency, to_currency, start, today,
+                on_result=lambda history: self.on_chart_data(from_currency, to_currency, *history),
+                on_error=self.on_chart_error
+            )
+
+        except Exception as e:
+            self.on_chart_error(e)
+
+    def on_chart_data(self, from_currency, to_currency, dates, rates, stats):
+        """
+        Передает загруженную историю курса во встроенный график.
+        """
+        try:
+            logging.info(f"Получено курсов: {len(rates)}")
 
             # Шаг 4: Проверка на наличие недостающих данных
-            if None in rates:
-                missing_dates = [dates[i].strftime('%d.%m.%Y') for i, rate in enumerate(rates) if rate is None]
-                print(f"Предупреждение: отсутствуют курсы для следующих дат: {', '.join(missing_dates)}")
-
-            # Шаг 5: Построение графика
-            plt.figure(figsize=(10, 6))  # Увеличиваем размер графика для лучшего восприятия
-            plt.plot(dates, rates, marker='o', linestyle='-', color='b', label=f"{from_currency} -> {to_currency}")
-
-            # Шаг 6: Улучшение внешнего вида графика
-            plt.title(f"Изменение курса {from_currency} -> {to_currency}", fontsize=16)
-            plt.xlabel("Дата", fontsize=14)
-            plt.ylabel(f"Курс {from_currency} к {to_currency}", fontsize=14)
-            plt.xticks(rotation=45, fontsize=12)
-            plt.yticks(fontsize=12)
-            plt.grid(True, linestyle='--', alpha=0.7)  # Добавляем сетку
-            plt.legend()
-
-            # Шаг 7: Обработка отсутствующих данных в графике
-            if None in rates:
-                plt.title(f"Ошибка данных для {from_currency} -> {to_currency}", fontsize=16)
-                plt.text(0.5, 0.5, "Не все данные доступны для отображения", ha='center', va='center', fontsize=12,
-                         color='r', transform=plt.gca().transAxes)
-
-            # Шаг 8: Скрытие панели инструментов
-            plt.rcParams['toolbar'] = 'None'  # Скрытие панели инструментов
-
-            # Шаг 9: Выводим график на экран
-            plt.tight_layout()  # Убираем лишние отступы
-            plt.show()
+            missing = np.isnan(rates)
+            if missing.any():
+                logging.warning(f"Отсутствуют курсы за {int(missing.sum())} дн.")
+
+            # Шаг 5: Обновление графика; виджет и его объекты переиспользуются между загрузками
+            self.chart.set_series(dates, rates, f"Изменение курса {from_currency} -> {to_currency}",
+                                  overlay=stats["mean"])
+            self.chart.show()
+            self.chart_stats_label.setText(self.format_chart_stats(stats))
+            self.chart_stats_label.show()
 
             # Логируем успешный вывод графика
-            print("График успешно построен и отображен.")
+            logging.info("График успешно построен и отображен.")
 
         except Exception as e:
-            # Обработка ошибок и вывод сообщения
-            print(f"Ошибка при построении графика: {e}")
-            self.show_error(f"Ошибка при построении графика: {e}")
+            self.on_chart_error(e)
+
+    @staticmethod
+    def format_chart_stats(stats):
+        """
+        Показатели последнего окна из ANALYTICS_WINDOW дат для подписи под графиком.
+        """
+        last = {name: values[-1] if len(values) else np.nan for name, values in stats.items()}
+        if not np.isfinite(last["mean"]):
+            return f"Недостаточно данных для показателей за {ANALYTICS_WINDOW} дат."
+        return (f"За {ANALYTICS_WINDOW} дат: среднее {last['mean']:.4f} (оранжевая линия), "
+                f"мин {last['low']:.4f}, макс {last['high']:.4f}, изменение {last['change'] * 100:+.2f}%, "
+                f"волатильность {last['volatility'] * 100:.2f}% в день")
+
+    def on_chart_error(self, error):
+        """
+        Обработка ошибок и вывод сообщения.
+        """
+        logging.error(f"Ошибка при построении графика: {error}")
+        self.show_error(f"Ошибка при построении графика: {error}")
 
 
 def main():
@@ -573,8 +3865,75 @@ def main():
         sys.exit(1)  # Завершаем приложение с кодом ошибки
 
     finally:
+        if metrics.enabled:
+            metrics.save()
         logging.info("Завершение работы приложения.")
 
 
+def run_cli(argv):
+    """
+    Консольные команды без графического интерфейса.
+    """
+    parser = argparse.ArgumentParser(description="Конвертер валют по курсам ЦБ РФ")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = subparsers.add_parser("batch", help="пакетная конвертация CSV/JSONL файла")
+    batch_parser.add_argument("input", help="входной файл .csv или .jsonl")
+    batch_parser.add_argument("output", help="выходной файл .csv или .jsonl")
+    batch_parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+
+    serve_parser = subparsers.add_parser("serve", help="HTTP-сервис конвертации")
+    serve_parser.add_argument("--host", default=SERVICE_HOST)
+    serve_parser.add_argument("--port", type=int, default=SERVICE_PORT)
+
+    backfill_parser = subparsers.add_parser("backfill", help="загрузка истории курсов в файл снимка")
+    backfill_parser.add_argument("output", help=f"файл снимка, например {RATE_SNAPSHOT_FILE}")
+    backfill_parser.add_argument("--start", type=parse_batch_date, default=BACKFILL_START,
+                                 help=f"первая дата, по умолчанию {BACKFILL_START.isoformat()}")
+    backfill_parser.add_argument("--end", type=parse_batch_date, default=None, help="последняя дата, по умолчанию сегодня")
+    backfill_parser.add_argument("--workers", type=int, default=FETCH_WORKERS, help="параллельных загрузок")
+    backfill_parser.add_argument("--parse-workers", type=int, default=None,
+                                 help="процессов разбора XML, по умолчанию по числу ядер; 0 - без пула процессов")
+    backfill_parser.add_argument("--shard-days", type=int, default=BACKFILL_SHARD_DAYS)
+
+    for command_parser in (batch_parser, serve_parser, backfill_parser):
+        command_parser.add_argument("--profile", metavar="FILE", nargs="?", const=METRICS_FILE,
+                                    help=f"собирать метрики и сохранить их в FILE (по умолчанию {METRICS_FILE})")
+
+    args = parser.parse_args(argv)
+    if args.profile:
+        metrics.enabled = True
+    try:
+        _run_cli_command(args)
+    finally:
+        if args.profile:
+            metrics.save(args.profile)
+            logging.info(f"Метрики сохранены в {args.profile}")
+
+
+def _run_cli_command(args):
+    if args.command == "batch":
+        stats = convert_file(args.input, args.output, args.chunk_size)
+        print(f"Готово: строк {stats['rows']}, ошибок {stats['errors']}")
+    elif args.command == "backfill":
+        stats = Backfill(args.output, args.start, args.end, args.workers, args.parse_workers, args.shard_days).run()
+        if stats["failed"]:
+            print(f"Не загружено частей: {stats['failed']} из {stats['shards']}. "
+                  f"Запустите команду повторно, готовые части загружаться не будут.")
+            sys.exit(1)
+        print(f"Готово: таблиц {stats['rows']}, запросов {stats['requests']}, "
+              f"частей с прошлого запуска {stats['resumed']} из {stats['shards']}")
+    elif args.command == "serve":
+        try:
+            asyncio.run(ConversionService().serve_forever(args.host, args.port))
+        except KeyboardInterrupt:
+            logging.info("Сервис конвертации остановлен.")
+
+
+CLI_COMMANDS = ("batch", "serve", "backfill")
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        run_cli(sys.argv[1:])
+    else:
+        main()